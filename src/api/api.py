@@ -1,15 +1,21 @@
+import functools
 import json
 import os
-from fastapi import FastAPI, HTTPException, Depends, Request, status, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Depends, Request, status, File, UploadFile, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse, RedirectResponse
-from pydantic import BaseModel, ConfigDict, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from typing import List, Dict, Any, Optional
 from src.db.db import User, get_mongo_db, MongoManager
 from src.services.scheduler_service import scheduler_manager
 from src.services.jobs import process_emails_with_scoring_and_reply, scheduled_crew_job
+from src.services import google_exec, google_http, gmail_push
+from src.services.gmail_d import GMAIL_DEFAULT_QUERY
+from src.services.google_auth import google_credentials
+from src.services.reply_queue import reply_sender
 import asyncio
 import logging
 from datetime import datetime, timedelta ,timezone
@@ -34,8 +40,22 @@ mongo_db = get_mongo_db()
 # Lifespan handler
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await mongo_db.ensure_indexes()
+    await mongo_db.migrate_legacy_crew_types()
     await scheduler_manager.init_scheduler()
+    if gmail_push.GMAIL_PUSH_TOPIC:
+        gmail_push.schedule_watch_renewal()
+    mongo_db.log_writer.start()
+    # The in-memory backend has no aggregation support, so there is nothing to roll up
+    if not mongo_db.registry.in_memory:
+        mongo_db.log_rollup.start()
+    reply_sender.start()
     yield
+    await reply_sender.stop()
+    await mongo_db.log_rollup.stop()
+    await mongo_db.log_writer.stop()
+    google_exec.shutdown(wait=False)
+    google_http.close_session()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -46,6 +66,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 logging.basicConfig(level=logging.INFO)
@@ -63,6 +84,7 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 GOOGLE_SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
     "https://www.googleapis.com/auth/gmail.send",
+    "https://www.googleapis.com/auth/gmail.modify",
     "https://www.googleapis.com/auth/calendar"
 ]
 GOOGLE_REDIRECT_URI = "https://2ee5-34-70-113-118.ngrok-free.app"
@@ -105,25 +127,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict:
             logger.error("Token missing 'sub' claim")
             raise credentials_exception
         logger.info(f"Decoded user_id: {user_id}")
-        user = await mongo_db.get_user(int(user_id))
-        if user is None:
+        principal = await mongo_db.get_user_identity(int(user_id))
+        if principal is None:
             logger.error(f"No user found for user_id: {user_id}")
             raise credentials_exception
-        if not isinstance(user, dict):
-            try:
-                user_dict = user.model_dump() if hasattr(user, 'model_dump') else user.dict()
-                logger.info(f"User converted to dict: {user_dict}")
-            except Exception as e:
-                logger.error(f"Failed to convert user to dict: {str(e)}")
-                raise credentials_exception
-        else:
-            user_dict = user
-            logger.info(f"User is already a dict: {user_dict}")
-        if 'user_id' not in user_dict:
-            logger.error(f"User dict missing 'user_id': {user_dict}")
-            raise credentials_exception
-        logger.info(f"User authenticated: {user_dict['user_id']}")
-        return user_dict
+        logger.info(f"User authenticated: {principal.user_id}")
+        return principal.model_dump()
     except jwt.ExpiredSignatureError:
         logger.error("Token has expired")
         raise credentials_exception
@@ -164,6 +173,10 @@ class ServiceUpdateInput(BaseModel):
     services: List[ServiceInput]
     model_config = ConfigDict()
 
+class GmailQueryInput(BaseModel):
+    query: str = Field("", max_length=512)
+    model_config = ConfigDict()
+
 class LinkedInCredentialsInput(BaseModel):
     client_id: str
     client_secret: str
@@ -175,6 +188,11 @@ class LinkedInAuthCompleteInput(BaseModel):
     model_config = ConfigDict()
 
 # Endpoints
+@app.get("/health/mongo")
+async def mongo_health():
+    """Connection pool metrics for the shared MongoDB client registry."""
+    return mongo_db.pool_metrics()
+
 @app.post("/users")
 async def create_user(input: UserInput):
     try:
@@ -237,6 +255,10 @@ async def create_user(input: UserInput):
                     "schedule": service.schedule
                 })
                 logger.info(f"Crew added with crew_id={crew_id}")
+                if service.service == "Gmail" and gmail_push.is_push_schedule(service.schedule):
+                    # No cron job; the watch starts once the user has granted Google access
+                    await start_gmail_watch_if_push(user_id, service.schedule)
+                    continue
                 logger.info(f"Scheduling job for user_id={user_id}, crew_id={crew_id}")
                 job_id = await scheduler_manager.schedule_job(
                     job_func=scheduled_crew_job,
@@ -330,7 +352,7 @@ async def upload_credentials(
             }
         }
         encrypted_creds = encrypt_credentials(credentials_to_store)
-        await db.update_user_credentials(user_id, encrypted_creds)
+        await db.update_user_credentials(user_id, encrypted_creds, decrypted=credentials_to_store)
 
         logger.info(f"Credentials uploaded successfully for user {user_id}")
         return {
@@ -358,17 +380,11 @@ async def get_user_info(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not authorized to access this user"
             )
-        user = await db.get_user(user_id)
-        if not user:
+        principal = await db.get_user_identity(user_id)
+        if not principal:
             logger.error(f"User not found: {user_id}")
             raise HTTPException(status_code=404, detail="User not found")
-        user_dict = user.model_dump() if hasattr(user, 'model_dump') else user.dict()
-        return {
-            "user_id": user_dict["user_id"],
-            "email": user_dict["email"],
-            "name": user_dict["name"],
-            "status": user_dict["status"]
-        }
+        return principal.model_dump()
     except HTTPException as e:
         logger.error(f"HTTP error in get_user_info for user {user_id}: {str(e)}")
         raise
@@ -390,14 +406,11 @@ async def get_credentials_status(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not authorized to access credentials status"
             )
-        user = await db.get_user(user_id)
-        if not user:
+        credentials = await db.get_user_credentials(user_id)
+        if credentials is None:
             logger.error(f"User not found: {user_id}")
             raise HTTPException(status_code=404, detail="User not found")
         
-        user_dict = user.model_dump() if hasattr(user, 'model_dump') else user.dict()
-        encrypted_creds = user_dict.get("api_credentials", "")
-        credentials = decrypt_credentials(encrypted_creds) if encrypted_creds else {}
         google_creds = credentials.get("google", {})
         linkedin_creds = credentials.get("linkedin", {})
 
@@ -468,8 +481,8 @@ async def update_user_services(user_id: int, input: ServiceUpdateInput, current_
         if current_user["user_id"] != user_id:
             logger.error(f"User {current_user['user_id']} not authorized for user_id={user_id}")
             raise HTTPException(status_code=403, detail="Not authorized to update this user's services")
-        user = await mongo_db.get_user(user_id)
-        if user is None:
+        user_status = await mongo_db.get_user_status(user_id)
+        if user_status is None:
             logger.error(f"User not found: {user_id}")
             raise HTTPException(status_code=404, detail="User not found")
         if not input.services:
@@ -480,6 +493,11 @@ async def update_user_services(user_id: int, input: ServiceUpdateInput, current_
         await mongo_db.update_user_schedule_prefs(user_id, schedule_prefs)
         logger.info(f"Schedule preferences updated for user_id: {user_id}")
         
+        if not gmail_push.is_push_schedule(schedule_prefs.get("Gmail")) and await mongo_db.has_gmail_watch(user_id):
+            # Leaving push: stop the watch so it is neither notified nor renewed any more
+            await gmail_push.stop_watch(user_id)
+            logger.info(f"Gmail push disabled for user {user_id}")
+        
         service_to_job = {
             "Gmail": process_emails_with_scoring_and_reply,
             "Calendar": scheduled_crew_job,
@@ -499,7 +517,16 @@ async def update_user_services(user_id: int, input: ServiceUpdateInput, current_
                 continue
             logger.info(f"Scheduling job for service: {service.service}")
             
-            if service.service == "Gmail":
+            if service.service == "Gmail" and gmail_push.is_push_schedule(schedule_prefs[service.service]):
+                # Event-driven: Gmail notifies /gmail/push on new mail instead of a cron poll
+                try:
+                    expires_at = await gmail_push.start_watch(user_id)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                await scheduler_manager.remove_jobs({"job_prefix": "email_scoring_and_reply_job", "user_id": user_id})
+                logger.info(f"Gmail push enabled for user {user_id}; watch expires {expires_at}")
+                continue
+            elif service.service == "Gmail":
                 # Schedule the combined scoring and reply job
                 job_id = await scheduler_manager.schedule_job(
                     job_func=job_func,
@@ -539,6 +566,36 @@ async def update_user_services(user_id: int, input: ServiceUpdateInput, current_
         logger.error(f"Error updating services for user_id {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update services: {str(e)}")
 
+async def start_gmail_watch_if_push(user_id: int, schedule: Optional[Dict[str, Any]]) -> None:
+    """Start the user's Gmail watch when their Gmail schedule is push; failures are logged, not raised."""
+    if not gmail_push.is_push_schedule(schedule):
+        return
+    try:
+        expires_at = await gmail_push.start_watch(user_id)
+        logger.info(f"Gmail push enabled for user {user_id}; watch expires {expires_at}")
+    except Exception as e:
+        logger.warning(f"Gmail watch not started for user {user_id} yet: {e}")
+
+@app.post("/gmail/push")
+async def gmail_push_notification(request: Request, token: Optional[str] = Query(None)):
+    """Pub/Sub push endpoint for Gmail watch notifications."""
+    if not gmail_push.verify_token(token):
+        logger.warning("Rejected Gmail push notification with an invalid token")
+        raise HTTPException(status_code=403, detail="Invalid push token")
+    try:
+        email_address, history_id = gmail_push.decode_envelope(await request.json())
+    except ValueError as e:
+        # Acknowledge anyway; Pub/Sub would otherwise redeliver a message that can never parse
+        logger.error(f"Dropping Gmail push notification: {e}")
+        return {"status": "malformed"}
+    try:
+        outcome = await gmail_push.handle_notification(email_address, history_id)
+    except Exception as e:
+        # A non-2xx response makes Pub/Sub redeliver with backoff
+        logger.error(f"Failed to handle Gmail push for {email_address}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to handle notification")
+    return {"status": outcome}
+
 import uuid
 from google_auth_oauthlib.flow import InstalledAppFlow
 
@@ -669,10 +726,13 @@ async def google_auth_complete(
             'grant_type': 'authorization_code'
         }
         try:
-            response = requests.post(token_url, data=data)
+            # Off the event loop: the shared pool may be busy with token refreshes
+            response = await google_exec.run_blocking(functools.partial(
+                google_http.get_session().post, token_url, data=data, timeout=google_http.default_timeout()
+            ))
             response.raise_for_status()
             token_data = response.json()
-        except requests.RequestException as e:
+        except (requests.RequestException, asyncio.TimeoutError) as e:
             logger.error(f"Token exchange request failed for user {user_id}: {str(e)}")
             raise HTTPException(status_code=500, detail="Failed to exchange token")
 
@@ -705,12 +765,17 @@ async def google_auth_complete(
         encrypted_creds = encrypt_credentials(credentials)
         logger.debug(f"Encrypted credentials for user {user_id}: [REDACTED]")
         try:
-            await db.update_user_credentials(user_id, encrypted_creds)
+            await db.update_user_credentials(user_id, encrypted_creds, decrypted=credentials)
+            # Tokens remembered from the previous grant must not be handed out again
+            google_credentials.forget(user_id)
             logger.info(f"Successfully updated user credentials for user {user_id} in database")
         except Exception as e:
             logger.error(f"Failed to update user credentials for user {user_id}: {str(e)}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"Database update failed: {str(e)}")
 
+        # A push schedule chosen before Google access was granted can start its watch now
+        await start_gmail_watch_if_push(user_id, user.schedule_prefs.get("Gmail"))
+
         logger.info(f"Google auth completed for user {user_id} at {time.strftime('%H:%M:%S')}")
         return {"status": "success", "message": "Google authentication completed"}
     except InvalidGrantError as e:
@@ -723,15 +788,72 @@ async def google_auth_complete(
         logger.error(f"Google auth completion error for user {user_id}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to complete Google auth: {str(e)}")
 @app.get("/users/{user_id}/jobs")
-async def get_user_jobs(user_id: int):
+async def get_user_jobs(
+    user_id: int,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None
+):
     try:
-        logger.info(f"Fetching jobs for user_id: {user_id}")
-        jobs = await mongo_db.get_user_jobs(user_id)
-        return JSONResponse(content=[job.model_dump() for job in jobs])
+        logger.info(f"Fetching jobs for user_id: {user_id}, limit={limit}, cursor={cursor}")
+        # Read one extra job to know whether another page exists
+        jobs = [job.model_dump() async for job in mongo_db.iter_user_jobs(user_id, after=cursor, limit=limit + 1)]
+        headers = {}
+        if len(jobs) > limit:
+            jobs = jobs[:limit]
+            headers["X-Next-Cursor"] = str(jobs[-1]["job_id"])
+        return JSONResponse(content=jobs, headers=headers)
     except Exception as e:
         logger.error(f"Error fetching jobs for user_id {user_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/users/{user_id}/execution-stats")
+async def get_execution_stats(
+    user_id: int,
+    hours: int = Query(24, ge=1, le=24 * 90),
+    crew_id: Optional[int] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    try:
+        if current_user["user_id"] != user_id:
+            logger.error(f"User {current_user['user_id']} not authorized for user_id={user_id}")
+            raise HTTPException(status_code=403, detail="Not authorized")
+        since = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+        buckets = await mongo_db.get_execution_stats(user_id, since, crew_id=crew_id)
+        return JSONResponse(content=jsonable_encoder(buckets))
+    except HTTPException as e:
+        logger.error(f"Execution stats error: {str(e)}")
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching execution stats for user_id {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/users/{user_id}/gmail-query")
+async def get_gmail_query(user_id: int, current_user: Dict = Depends(get_current_user)):
+    if current_user["user_id"] != user_id:
+        logger.error(f"User {current_user['user_id']} not authorized for user_id={user_id}")
+        raise HTTPException(status_code=403, detail="Not authorized")
+    query = await mongo_db.get_gmail_query(user_id)
+    return {"query": query or "", "effective_query": query or GMAIL_DEFAULT_QUERY}
+
+@app.put("/users/{user_id}/gmail-query")
+async def update_gmail_query(user_id: int, input: GmailQueryInput, current_user: Dict = Depends(get_current_user)):
+    """Set the Gmail search query (e.g. "is:unread newer_than:2d -category:promotions") Gmail applies when fetching mail."""
+    try:
+        if current_user["user_id"] != user_id:
+            logger.error(f"User {current_user['user_id']} not authorized for user_id={user_id}")
+            raise HTTPException(status_code=403, detail="Not authorized")
+        if not await mongo_db.set_gmail_query(user_id, input.query):
+            raise HTTPException(status_code=404, detail="User not found")
+        query = input.query.strip()
+        logger.info(f"Gmail query for user {user_id} set to {query!r}")
+        return {"query": query, "effective_query": query or GMAIL_DEFAULT_QUERY}
+    except HTTPException as e:
+        logger.error(f"Gmail query update error: {str(e)}")
+        raise
+    except Exception as e:
+        logger.error(f"Error updating Gmail query for user_id {user_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/users/{user_id}/linkedin-app")
 async def save_linkedin_credentials(user_id: int, input: LinkedInCredentialsInput, current_user: Dict = Depends(get_current_user)):
     try:
@@ -750,7 +872,7 @@ async def save_linkedin_credentials(user_id: int, input: LinkedInCredentialsInpu
             "client_secret": input.client_secret
         }
         encrypted_credentials = encrypt_credentials(credentials)
-        await mongo_db.update_user_credentials(user_id, encrypted_credentials)
+        await mongo_db.update_user_credentials(user_id, encrypted_credentials, decrypted=credentials)
         logger.info(f"LinkedIn credentials saved for user_id={user_id}")
         return {"message": "LinkedIn credentials saved successfully"}
     except HTTPException as e:
@@ -861,7 +983,7 @@ async def complete_linkedin_auth(user_id: int, input: LinkedInAuthCompleteInput,
             raise HTTPException(status_code=400, detail="No access token received")
         credentials["linkedin"]["access_token"] = access_token
         encrypted_credentials = encrypt_credentials(credentials)
-        await mongo_db.update_user_credentials(user_id, encrypted_credentials)
+        await mongo_db.update_user_credentials(user_id, encrypted_credentials, decrypted=credentials)
         logger.info(f"Stored LinkedIn access token for user_id={user_id}")
         await mongo_db.delete_oauth_state(user_id, service="linkedin")
         return {"message": "LinkedIn authentication successful"}
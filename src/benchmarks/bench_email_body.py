@@ -0,0 +1,150 @@
+"""Micro-benchmark for email body extraction.
+
+Compares src.services.email_body.extract_body with the previous gmail_d implementation
+(new HTML2Text per call, one level of parts, a dozen uncompiled re.sub passes) over a
+synthetic corpus shaped like a recruiting inbox.
+
+    python -m src.benchmarks.bench_email_body [--repeat N]
+"""
+import argparse
+import base64
+import re
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+from html2text import HTML2Text
+from src.services.email_body import extract_body
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+def _text(mime_type: str, text: str) -> Dict:
+    return {"mimeType": mime_type, "body": {"data": _b64(text), "size": len(text)}}
+
+def _newsletter_html(rows: int) -> str:
+    row = (
+        "<tr><td style='padding:8px'><a href='https://news.example.com/item?utm_source=mail&amp;id={i}'>"
+        "<img src='https://cdn.example.com/{i}.png' alt='thumb'></a></td>"
+        "<td><h3>Open role #{i}: Senior Engineer</h3><p>We are hiring across <b>three</b> teams. "
+        "Apply before Friday &mdash; relocation available.</p>"
+        "<a href='https://track.example.com/tracking/click?u={i}'>Read more</a></td></tr>"
+    )
+    return (
+        "<html><head><style>td{font-family:Arial}</style></head><body><table>"
+        + "".join(row.format(i=i) for i in range(rows))
+        + "</table><p>Unsubscribe</p></body></html>"
+    )
+
+def build_corpus() -> List[Tuple[str, Dict]]:
+    plain = (
+        "Hi Sarah,\n\nCould we move the interview with the candidate to Thursday 3pm?\n"
+        "The hiring manager is travelling.\n\nBest regards,\nTom\n555-123-4567\n"
+    )
+    reply_thread = plain + "\n".join(
+        f"> On Mon, someone wrote:\n> previous message line {i} with some quoted context" for i in range(200)
+    )
+    return [
+        ("plain_short", _text("text/plain", plain)),
+        ("html_only", _text("text/html", "<div><p>" + "<br>".join(plain.splitlines()) + "</p></div>")),
+        ("alternative", {
+            "mimeType": "multipart/alternative",
+            "parts": [_text("text/plain", plain), _text("text/html", "<p>" + plain + "</p>")],
+        }),
+        ("nested_mixed_with_attachment", {
+            "mimeType": "multipart/mixed",
+            "parts": [
+                {"mimeType": "multipart/alternative", "parts": [
+                    _text("text/plain", plain * 3),
+                    {"mimeType": "multipart/related", "parts": [
+                        _text("text/html", "<p>" + plain * 3 + "</p>"),
+                        {"mimeType": "image/png", "filename": "logo.png", "body": {"attachmentId": "a1", "size": 20480}},
+                    ]},
+                ]},
+                {"mimeType": "application/pdf", "filename": "resume.pdf", "body": {"attachmentId": "a2", "size": 204800}},
+            ],
+        }),
+        ("long_reply_thread", _text("text/plain", reply_thread)),
+        ("newsletter_200kb", {
+            "mimeType": "multipart/alternative",
+            "parts": [_text("text/html", _newsletter_html(450))],
+        }),
+        ("newsletter_3mb", _text("text/html", _newsletter_html(7000))),
+    ]
+
+# Baseline: the implementation that shipped in gmail_d before email_body existed
+
+def _legacy_clean(body: str) -> str:
+    if not body:
+        return ""
+    body = re.sub(r'<[^>]+>', '', body)
+    body = re.sub(r'\n-{4,}\s*', '\n---\n', body)
+    body = re.sub(r'https?://[^\s]*(tracking|utm_)[^\s]*', '', body, flags=re.IGNORECASE)
+    for pattern in [
+        r'^\s*--\s*$.*',
+        r'\nSent from my .+\n',
+        r'\nBest regards,\n.*',
+        r'\nSincerely,\n.*',
+        r'\nCheers,\n.*',
+        r'\n\d{3}-\d{3}-\d{4}',
+    ]:
+        body = re.sub(pattern, '', body, flags=re.IGNORECASE | re.MULTILINE)
+    body = re.sub(r'[ \t]+', ' ', body)
+    body = re.sub(r'\n{3,}', '\n\n', body)
+    return body.strip()
+
+def legacy_extract_body(payload: Dict) -> str:
+    if 'parts' not in payload:
+        data = payload.get('body', {}).get('data', '')
+        if not data:
+            return ""
+        return _legacy_clean(base64.urlsafe_b64decode(data).decode('utf-8', errors='replace'))
+    converter = HTML2Text()
+    converter.ignore_links = False
+    converter.ignore_images = True
+    converter.ignore_tables = True
+    converter.ignore_emphasis = False
+    converter.body_width = 0
+    converter.single_line_break = True
+    body_parts = []
+    for part in payload['parts']:
+        data = part.get('body', {}).get('data', '')
+        if not data:
+            continue
+        decoded = base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+        if part.get('mimeType') == 'text/plain':
+            body_parts.append(decoded)
+        elif part.get('mimeType') == 'text/html':
+            body_parts.append(converter.handle(decoded))
+    return _legacy_clean("\n\n".join(body_parts))
+
+def _measure(func: Callable[[Dict], str], payload: Dict, repeat: int) -> Tuple[float, int]:
+    timings = []
+    output = ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = func(payload)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), len(output)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+    print(f"{'payload':<30} {'size':>9} {'legacy ms':>10} {'new ms':>9} {'speedup':>8} {'legacy chars':>13} {'new chars':>10}")
+    totals = [0.0, 0.0]
+    for name, payload in corpus:
+        size = len(str(payload))
+        legacy_s, legacy_len = _measure(legacy_extract_body, payload, args.repeat)
+        new_s, new_len = _measure(extract_body, payload, args.repeat)
+        totals[0] += legacy_s
+        totals[1] += new_s
+        print(
+            f"{name:<30} {size:>9} {legacy_s * 1000:>10.2f} {new_s * 1000:>9.2f} "
+            f"{legacy_s / new_s if new_s else float('inf'):>7.1f}x {legacy_len:>13} {new_len:>10}"
+        )
+    print(f"{'total':<30} {'':>9} {totals[0] * 1000:>10.2f} {totals[1] * 1000:>9.2f} {totals[0] / totals[1]:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ import json
 from crewai import LLM
 from src.tools.g_tools_d  import FetchRecentEmailsTool
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 # Load environment variables
 load_dotenv()
@@ -53,17 +53,19 @@ class Email_reply(BaseModel):
 
 
 class CrewContext:
-    def __init__(self, user_id: int):
+    def __init__(self, user_id: int, incremental: Optional[bool] = None, with_fetch_tool: bool = True):
         self.user_id = user_id
+        self.incremental = incremental
         try:
-            self.tools = self._create_tools()
+            # Without the fetch tool the scoring crew scores only the emails passed as {context}
+            self.tools = self._create_tools() if with_fetch_tool else []
         except Exception as e:
             logger.error(f"Error creating tools for user {user_id}: {e}")
             self.tools = []  # Fallback to empty tools list
 
     def _create_tools(self):
         try:
-            return [FetchRecentEmailsTool(user_id=self.user_id)]
+            return [FetchRecentEmailsTool(user_id=self.user_id, incremental=self.incremental)]
         except Exception as e:
             logger.error(f"Tool creation failed for user {self.user_id}: {e}")
             return []
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, monitoring
+from src.db.memory_backend import MemoryClient
+
+logger = logging.getLogger(__name__)
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+# "mongodb" (default) or "memory" for the in-process stand-in used for profiling without a mongod
+MONGO_BACKEND = os.getenv("MONGO_BACKEND", "mongodb").lower()
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# Pool size for clients bound to secondary event loops (tool runs, follow-up jobs)
+MONGO_SECONDARY_POOL_SIZE = int(os.getenv("MONGO_SECONDARY_POOL_SIZE", "5"))
+# Secondary clients kept at most; the least recently used one is closed beyond this
+MONGO_MAX_SECONDARY_CLIENTS = int(os.getenv("MONGO_MAX_SECONDARY_CLIENTS", "8"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")  # e.g. "zstd,snappy,zlib"
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events across every client created by the registry."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {
+            "pools": 0,
+            "connections_open": 0,
+            "connections_created": 0,
+            "connections_closed": 0,
+            "checked_out": 0,
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "pool_clears": 0,
+        }
+
+    def _bump(self, **deltas: int) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def pool_created(self, event):
+        self._bump(pools=1)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump(pool_clears=1)
+
+    def pool_closed(self, event):
+        self._bump(pools=-1)
+
+    def connection_created(self, event):
+        self._bump(connections_open=1, connections_created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump(connections_open=-1, connections_closed=1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump(checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._bump(checked_out=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._bump(checked_out=-1)
+
+class MongoClientRegistry:
+    """Owns the MongoDB clients for a process so every component shares one pool.
+
+    The primary Motor client serves the first event loop that asks for it (the API /
+    scheduler loop), and its underlying pymongo client is handed out as the sync client
+    for APScheduler, so both share one connection pool. Motor binds a client to a single
+    event loop, so other loops (tools and follow-up jobs that run their own loop) get a
+    small client of their own, which is closed once that loop is closed. After a fork
+    the registry drops inherited clients and builds new ones.
+    """
+
+    def __init__(self, uri: str = MONGO_URI, backend: str = MONGO_BACKEND):
+        self.uri = uri
+        self.backend = backend
+        self.metrics = PoolMetricsListener()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._primary: Optional[AsyncIOMotorClient] = None
+        self._primary_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Secondary clients hold a reference to their loop, so a weak key would never clear. Entries
+        # are pruned once the loop closes, and the least recently used is evicted past the cap so
+        # loops a caller never closes cannot pile up clients
+        self._secondary: "OrderedDict[asyncio.AbstractEventLoop, AsyncIOMotorClient]" = OrderedDict()
+
+    def client_options(self, max_pool_size: int = MONGO_MAX_POOL_SIZE) -> Dict[str, Any]:
+        options: Dict[str, Any] = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min(MONGO_MIN_POOL_SIZE, max_pool_size),
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "event_listeners": [self.metrics],
+        }
+        if MONGO_SOCKET_TIMEOUT_MS:
+            options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+        if MONGO_COMPRESSORS:
+            options["compressors"] = MONGO_COMPRESSORS
+        return options
+
+    def _check_fork(self) -> None:
+        if self._pid != os.getpid():
+            logger.info("Process fork detected; discarding inherited MongoDB clients")
+            self._pid = os.getpid()
+            self._primary = None
+            self._primary_loop = None
+            self._secondary = OrderedDict()
+
+    @property
+    def in_memory(self) -> bool:
+        return self.backend == "memory"
+
+    def _ensure_primary(self) -> AsyncIOMotorClient:
+        if self._primary is None and self.in_memory:
+            self._primary = MemoryClient()
+            logger.info("Using in-memory MongoDB backend")
+        elif self._primary is None:
+            self._primary = AsyncIOMotorClient(self.uri, **self.client_options())
+            logger.info("Created shared MongoDB client")
+        return self._primary
+
+    def _close_dead_loops(self) -> None:
+        for loop, client in list(self._secondary.items()):
+            if loop.is_closed():
+                client.close()
+                del self._secondary[loop]
+
+    def get_async_client(self) -> AsyncIOMotorClient:
+        """Motor client for the current event loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        with self._lock:
+            self._check_fork()
+            primary = self._ensure_primary()
+            # The in-memory store is not bound to an event loop, so every caller shares it
+            if self.in_memory or loop is None or self._primary_loop is loop:
+                return primary
+            if self._primary_loop is None:
+                self._primary_loop = loop
+                return primary
+            if self._primary_loop.is_closed():
+                # Motor stays bound to the closed loop, so start a new primary client. The old one
+                # is left open because its pymongo client may still be in use as the sync client.
+                logger.info("Primary event loop closed; creating a new shared MongoDB client")
+                self._primary = None
+                self._primary_loop = loop
+                return self._ensure_primary()
+
+            self._close_dead_loops()
+            client = self._secondary.get(loop)
+            if client is None:
+                client = AsyncIOMotorClient(
+                    self.uri, io_loop=loop, **self.client_options(MONGO_SECONDARY_POOL_SIZE)
+                )
+                self._secondary[loop] = client
+                logger.debug(f"Created MongoDB client for secondary event loop {id(loop)}")
+                while len(self._secondary) > max(1, MONGO_MAX_SECONDARY_CLIENTS):
+                    stale_loop, stale = self._secondary.popitem(last=False)
+                    stale.close()
+                    logger.warning(f"Closed MongoDB client of idle event loop {id(stale_loop)}; its loop was never closed")
+            else:
+                self._secondary.move_to_end(loop)
+            return client
+
+    def get_database(self, name: str):
+        return self.get_async_client()[name]
+
+    def get_sync_client(self) -> MongoClient:
+        """Blocking pymongo client that shares the primary client's connection pool."""
+        if self.in_memory:
+            raise RuntimeError("No sync MongoDB client with MONGO_BACKEND=memory")
+        with self._lock:
+            self._check_fork()
+            return self._ensure_primary().delegate
+
+    def pool_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            self._close_dead_loops()
+            secondary_clients = len(self._secondary)
+        return {
+            **self.metrics.snapshot(),
+            "backend": self.backend,
+            "clients": (1 if self._primary is not None else 0) + secondary_clients,
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "secondary_pool_size": MONGO_SECONDARY_POOL_SIZE,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for client in list(self._secondary.values()):
+                client.close()
+            self._secondary = {}
+            if self._primary is not None:
+                self._primary.close()
+                self._primary = None
+                self._primary_loop = None
+        logger.info("Closed MongoDB clients")
+
+_registries: Dict[str, MongoClientRegistry] = {}
+_registries_lock = threading.Lock()
+
+def get_client_registry(uri: Optional[str] = None) -> MongoClientRegistry:
+    """Process-wide registry for a MongoDB URI (defaults to MONGO_URI)."""
+    uri = uri or MONGO_URI
+    with _registries_lock:
+        registry = _registries.get(uri)
+        if registry is None:
+            registry = _registries[uri] = MongoClientRegistry(uri)
+        return registry
@@ -1,19 +1,45 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel, ConfigDict, EmailStr
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict
+import copy
 import logging
 import asyncio
 import threading
+import time
+from src.api.cred_cryp import decrypt_credentials
+from src.db.client import MongoClientRegistry, get_client_registry
+from src.db.log_writer import ExecutionLogWriter
+from src.db.indexes import IndexManager
+from src.db.sequences import id_allocator
+from src.db.execution_logs import (
+    EXECUTION_LOG_ROLLUPS,
+    ExecutionLogRollup,
+    ensure_execution_log_collection,
+    normalize_execution_log,
+)
 
-_local = threading.local()
+_mongo_db = None
+_mongo_db_lock = threading.Lock()
 
 logger = logging.getLogger(__name__)
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client.crewai_scheduler
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "100"))
+
+CREDENTIAL_CACHE_TTL = float(os.getenv("CREDENTIAL_CACHE_TTL", "300"))
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "1024"))
+
+CREW_CACHE_TTL = float(os.getenv("CREW_CACHE_TTL", "600"))
+CREW_CACHE_SIZE = int(os.getenv("CREW_CACHE_SIZE", "4096"))
+
+# Ledger entries with a failed action are handed out again until they failed this often
+PROCESSED_MESSAGE_MAX_FAILURES = int(os.getenv("PROCESSED_MESSAGE_MAX_FAILURES", "3"))
+
+# Crew types renamed since the first release: old value -> current value
+LEGACY_CREW_TYPES = {"email": "email_scoring"}
 
 class User(BaseModel):
     user_id: int
@@ -23,8 +49,24 @@ class User(BaseModel):
     password_hash: str
     api_credentials: str = ""  # Encrypted credentials
     schedule_prefs: Dict[str, Any] = {}
+    gmail_query: str = ""  # Gmail search query applied when fetching mail
+    model_config = ConfigDict()
+
+class Principal(BaseModel):
+    """Slim identity of an authenticated user, without password hash or credentials."""
+    user_id: int
+    email: str
+    name: str = ""
+    status: str = ""
     model_config = ConfigDict()
 
+USER_IDENTITY_PROJECTION = {"_id": 0, "user_id": 1, "email": 1, "name": 1, "status": 1}
+CREW_PROJECTION = {"_id": 0, "crew_id": 1, "user_id": 1, "crew_type": 1, "schedule": 1}
+JOB_PROJECTION = {
+    "_id": 0, "job_id": 1, "user_id": 1, "crew_id": 1, "schedule": 1,
+    "status": 1, "last_run": 1, "next_run": 1
+}
+
 class Crew(BaseModel):
     crew_id: int
     user_id: int
@@ -42,34 +84,173 @@ class Job(BaseModel):
     next_run: Optional[str] = None
     model_config = ConfigDict()
 
+class CredentialCache:
+    """Process-wide LRU cache of decrypted user credentials with a TTL.
+
+    Entries are keyed by user_id. Writers must call put() or invalidate()
+    whenever the stored credentials change so token refreshes stay consistent.
+    """
+
+    def __init__(self, ttl: float = CREDENTIAL_CACHE_TTL, max_size: int = CREDENTIAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, credentials = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+        # Hand out a copy so callers can mutate token data without touching the cache
+        return copy.deepcopy(credentials)
+
+    def put(self, user_id: int, credentials: Dict[str, Any]) -> None:
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        entry = (time.monotonic() + self.ttl, copy.deepcopy(credentials))
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+credential_cache = CredentialCache()
+
+class CrewCache:
+    """Process-wide read-through cache of crew documents keyed by crew_id.
+
+    Every crew_id carries a version that invalidate() bumps. A reader takes the
+    version before querying MongoDB and passes it to put(), so a read that raced
+    with update_crew() cannot store the stale document.
+    """
+
+    def __init__(self, ttl: float = CREW_CACHE_TTL, max_size: int = CREW_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def version(self, crew_id: int) -> int:
+        with self._lock:
+            return self._versions.get(crew_id, 0)
+
+    def get(self, crew_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(crew_id)
+            if entry is None:
+                return None
+            expires_at, crew = entry
+            if expires_at <= time.monotonic():
+                del self._entries[crew_id]
+                return None
+            self._entries.move_to_end(crew_id)
+        return copy.deepcopy(crew)
+
+    def put(self, crew_id: int, crew: Dict[str, Any], version: int) -> None:
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        entry = (time.monotonic() + self.ttl, copy.deepcopy(crew))
+        with self._lock:
+            if self._versions.get(crew_id, 0) != version:
+                return
+            self._entries[crew_id] = entry
+            self._entries.move_to_end(crew_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, crew_id: int) -> None:
+        with self._lock:
+            self._entries.pop(crew_id, None)
+            self._versions[crew_id] = self._versions.get(crew_id, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for crew_id in self._versions:
+                self._versions[crew_id] += 1
+
+crew_cache = CrewCache()
+
 class MongoManager:
-    def __init__(self, uri="mongodb://localhost:27017", db_name="crewai_scheduler"):
-        self.uri = uri
+    def __init__(self, uri: Optional[str] = None, db_name="crewai_scheduler"):
+        self.registry: MongoClientRegistry = get_client_registry(uri)
+        self.uri = self.registry.uri
         self.db_name = db_name
-        self.client = None
-        self.db = None
-        self.users = None
-        self.crews = None
-        self.oauth_states = None
-        self.execution_logs = None
-        self.services = None
+        self.credential_cache = credential_cache
+        self.crew_cache = crew_cache
+        self.log_writer = ExecutionLogWriter(lambda: self.execution_logs)
+        self.id_allocator = id_allocator
+        self.log_rollup = ExecutionLogRollup(lambda: self.db)
         self.connect()  # Initialize connection on creation
 
     def connect(self):
         try:
-            self.client = AsyncIOMotorClient(self.uri)
-            self.db = self.client[self.db_name]
-            # Initialize all collections
-            self.users = self.db["users"]
-            self.crews = self.db["crews"]
-            self.oauth_states = self.db["oauth_states"]
-            self.execution_logs = self.db["execution_logs"]
-            self.services = self.db["services"]
+            # Clients are created lazily by the shared registry; this only validates the configuration
+            self.registry.get_async_client()
             logger.info("Connected to MongoDB")
         except Exception as e:
             logger.error(f"Error connecting to MongoDB: {e}")
             raise
 
+    # Collections resolve through the registry so each event loop uses a client bound to it
+    @property
+    def client(self):
+        return self.registry.get_async_client()
+
+    @property
+    def db(self):
+        return self.registry.get_database(self.db_name)
+
+    @property
+    def users(self):
+        return self.db["users"]
+
+    @property
+    def crews(self):
+        return self.db["crews"]
+
+    @property
+    def oauth_states(self):
+        return self.db["oauth_states"]
+
+    @property
+    def execution_logs(self):
+        return self.db["execution_logs"]
+
+    @property
+    def services(self):
+        return self.db["services"]
+
+    @property
+    def gmail_sync_state(self):
+        return self.db["gmail_sync_state"]
+
+    @property
+    def processed_messages(self):
+        return self.db["processed_messages"]
+
+    @property
+    def outbound_replies(self):
+        return self.db["outbound_replies"]
+
+    def pool_metrics(self) -> Dict[str, Any]:
+        return self.registry.pool_metrics()
+
     async def store_oauth_state(self, user_id: int, state: str, expires_at: datetime, service: str):
         try:
             logger.info(f"Storing OAuth state: user_id={user_id}, service={service}, state={state}, expires_at={expires_at}")
@@ -142,13 +323,13 @@ class MongoManager:
             raise
 
     async def get_next_sequence(self, name: str) -> int:
-        result = await self.db.counters.find_one_and_update(
-            {"_id": name},
-            {"$inc": {"seq": 1}},
-            upsert=True,
-            return_document=True
-        )
-        return result["seq"]
+        """Next ID for `name`, served from a locally reserved block of the counter.
+
+        IDs are unique across processes but increase only within one process: another
+        process hands out IDs from its own block, so IDs do not follow creation order
+        across processes.
+        """
+        return await self.id_allocator.next_id(self.db.counters, name)
 
     # Users
     async def create_user(self, user_data: Dict) -> int:
@@ -173,14 +354,50 @@ class MongoManager:
         user = await self.db.users.find_one({"user_id": user_id})
         return User(**user) if user else None
     
+    async def get_user_identity(self, user_id: int) -> Optional[Principal]:
+        """Fetch only the identity fields of a user (no password hash or credentials)."""
+        user = await self.db.users.find_one({"user_id": user_id}, USER_IDENTITY_PROJECTION)
+        return Principal(**user) if user else None
+
+    async def get_user_status(self, user_id: int) -> Optional[str]:
+        """Fetch only the status of a user; None if the user does not exist."""
+        user = await self.db.users.find_one({"user_id": user_id}, {"_id": 0, "status": 1})
+        return user.get("status", "") if user else None
+
     async def get_user_by_attributes(self, attributes: Dict) -> Optional[Dict]:
         return await self.db.users.find_one(attributes)
 
-    async def update_user_credentials(self, user_id: int, credentials: Dict[str, Any]) -> None:
+    async def get_user_credentials(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Return the decrypted api_credentials for a user, served from the cache when fresh.
+
+        Returns None if the user does not exist and {} if no credentials are stored.
+        """
+        cached = self.credential_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        user = await self.db.users.find_one({"user_id": user_id}, {"api_credentials": 1})
+        if not user:
+            return None
+        encrypted_creds = user.get("api_credentials") or ""
+        credentials = decrypt_credentials(encrypted_creds) if encrypted_creds else {}
+        self.credential_cache.put(user_id, credentials)
+        return copy.deepcopy(credentials)
+
+    async def update_user_credentials(self, user_id: int, credentials: Dict[str, Any], decrypted: Optional[Dict[str, Any]] = None) -> None:
+        """Store encrypted credentials and keep the credential cache in step.
+
+        When the caller already holds the plaintext it can pass it as `decrypted`
+        to refresh the cache entry; otherwise the entry is invalidated.
+        """
         await self.db.users.update_one(
             {"user_id": user_id},
             {"$set": {"api_credentials": credentials}}
         )
+        if decrypted is not None:
+            self.credential_cache.put(user_id, decrypted)
+        else:
+            self.credential_cache.invalidate(user_id)
 
     async def update_user_schedule_prefs(self, user_id: int, schedule_prefs: Dict[str, Any]) -> None:
         await self.db.users.update_one(
@@ -188,6 +405,16 @@ class MongoManager:
             {"$set": {"schedule_prefs": schedule_prefs}}
         )
 
+    async def get_gmail_query(self, user_id: int) -> Optional[str]:
+        """The user's Gmail search query, or None if they have not set one."""
+        user = await self.db.users.find_one({"user_id": user_id}, {"_id": 0, "gmail_query": 1})
+        return (user.get("gmail_query") or None) if user else None
+
+    async def set_gmail_query(self, user_id: int, query: str) -> bool:
+        """Store the user's Gmail search query; an empty query restores the default. False if no such user."""
+        result = await self.db.users.update_one({"user_id": user_id}, {"$set": {"gmail_query": query.strip()}})
+        return result.matched_count > 0
+
     async def get_user_id_by_state(self, state: str) -> int:
         """Retrieve user ID by OAuth state"""
         try:
@@ -199,18 +426,28 @@ class MongoManager:
 
     # Crews
     async def add_crew(self, user_id: int, crew_data: Dict) -> int:
+        """Store a crew and return its crew_id. crew_ids are unique, but ordered by creation
+        only within one process (see get_next_sequence)."""
         crew_id = await self.get_next_sequence("crew_id")
         await self.db.crews.insert_one({
             "crew_id": crew_id,
             "user_id": user_id,
             **crew_data
         })
+        self.crew_cache.invalidate(crew_id)
         return crew_id
 
     async def get_crew(self, crew_id: int):
-        """Get crew by ID"""
+        """Get crew by ID (served from the crew cache when possible)"""
+        crew = self.crew_cache.get(crew_id)
+        if crew is not None:
+            return crew
         try:
-            return await self.crews.find_one({"crew_id": crew_id})
+            version = self.crew_cache.version(crew_id)
+            crew = await self.crews.find_one({"crew_id": crew_id}, {"_id": 0})
+            if crew is not None:
+                self.crew_cache.put(crew_id, crew, version)
+            return crew
         except Exception as e:
             logger.error(f"Error getting crew {crew_id}: {e}")
             return None
@@ -218,21 +455,58 @@ class MongoManager:
     async def update_crew(self, crew_id: int, update_data: dict) -> bool:
         """Update crew document by ID"""
         try:
+            self.crew_cache.invalidate(crew_id)
             result = await self.crews.update_one(
                 {"crew_id": crew_id},
                 {"$set": update_data}
             )
+            # Invalidate again so a read that started during the write is not cached
+            self.crew_cache.invalidate(crew_id)
             return result.modified_count > 0
         except Exception as e:
             logger.error(f"Error updating crew {crew_id}: {e}")
             return False
+
+    async def migrate_legacy_crew_types(self) -> int:
+        """Rename legacy crew types in bulk. Run once at startup; returns crews migrated."""
+        migrated = 0
+        for old_type, new_type in LEGACY_CREW_TYPES.items():
+            try:
+                result = await self.crews.update_many(
+                    {"crew_type": old_type},
+                    {"$set": {"crew_type": new_type}}
+                )
+                migrated += result.modified_count
+                if result.modified_count:
+                    logger.info(f"Migrated {result.modified_count} crews from '{old_type}' to '{new_type}'")
+            except Exception as e:
+                logger.error(f"Failed to migrate '{old_type}' crews: {e}")
+        if migrated:
+            self.crew_cache.clear()
+        return migrated
     
+    async def iter_user_crews(
+        self,
+        user_id: int,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+        batch_size: int = CURSOR_BATCH_SIZE
+    ) -> AsyncIterator[Crew]:
+        """Stream a user's crews ordered by crew_id, resuming after the `after` crew_id."""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if after is not None:
+            query["crew_id"] = {"$gt": after}
+        cursor = self.db.crews.find(query, CREW_PROJECTION).sort("crew_id", ASCENDING).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for doc in cursor:
+            yield Crew(**doc)
+
     async def get_user_crews(self, user_id: int) -> List[Crew]:
         crews = []
         try:
-            cursor = self.db.crews.find({"user_id": user_id})
-            async for doc in cursor:
-                crews.append(Crew(**doc))
+            async for crew in self.iter_user_crews(user_id):
+                crews.append(crew)
         except Exception as e:
             logger.error(f"Error iterating cursor: {e}")
         return crews
@@ -249,14 +523,27 @@ class MongoManager:
         })
         return job_id
 
-    async def get_user_jobs(self, user_id: int) -> List[Job]:
-        jobs = []
-        cursor = self.db.jobs.find({"user_id": user_id})
+    async def iter_user_jobs(
+        self,
+        user_id: int,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+        batch_size: int = CURSOR_BATCH_SIZE
+    ) -> AsyncIterator[Job]:
+        """Stream a user's jobs ordered by job_id, resuming after the `after` job_id (keyset pagination)."""
+        query: Dict[str, Any] = {"user_id": user_id}
+        if after is not None:
+            query["job_id"] = {"$gt": after}
+        cursor = self.db.jobs.find(query, JOB_PROJECTION).sort("job_id", ASCENDING).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
         async for doc in cursor:
             # Ensure next_run is included
             doc["next_run"] = doc.get("next_run", datetime.now().isoformat())
-            jobs.append(Job(**doc))
-        return jobs
+            yield Job(**doc)
+
+    async def get_user_jobs(self, user_id: int) -> List[Job]:
+        return [job async for job in self.iter_user_jobs(user_id)]
     
     async def find_one(self, collection_name: str, query: Dict) -> Optional[Dict]:
      try:
@@ -275,22 +562,247 @@ class MongoManager:
          logger.error(f"Failed to find one in {collection_name}: {str(e)}", exc_info=True)
          raise
     
+    async def ensure_indexes(self) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+        """Set up the execution log collection, create all declared indexes and log any remaining drift."""
+        await ensure_execution_log_collection(self.db)
+        index_manager = IndexManager(self.db)
+        await index_manager.ensure_indexes()
+        drift = await index_manager.report()
+        for collection_name, details in drift.items():
+            logger.warning(f"Index drift on {collection_name}: {details}")
+        return drift
+
     async def log_execution(self, log_data):
+        """Queue an execution log entry; it is written in batches by the log writer.
+
+        Entries carry no sequence ID and batches from different processes interleave,
+        so order them by `timestamp`.
+        """
         try:
-            await self.db.execution_logs.insert_one(log_data)
+            await self.log_writer.write(normalize_execution_log(log_data))
         except Exception as e:
             logger.error(f"[ERROR] Failed to log execution: {e}")
 
+    async def get_execution_stats(
+        self,
+        user_id: int,
+        since: datetime,
+        crew_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Hourly execution counts and durations for a user, read from the rollup collection."""
+        query: Dict[str, Any] = {"user_id": user_id, "hour": {"$gte": since}}
+        if crew_id is not None:
+            query["crew_id"] = crew_id
+        cursor = self.db[EXECUTION_LOG_ROLLUPS].find(query, {"_id": 0}).sort("hour", ASCENDING)
+        return [doc async for doc in cursor]
+
+    # Gmail sync checkpoints
+    async def get_gmail_history_id(self, user_id: int) -> Optional[str]:
+        """Last Gmail historyId synced for a user, or None before the first sync."""
+        state = await self.gmail_sync_state.find_one({"user_id": user_id}, {"_id": 0, "history_id": 1})
+        return state.get("history_id") if state else None
+
+    async def set_gmail_history_id(self, user_id: int, history_id: str) -> None:
+        try:
+            await self.gmail_sync_state.update_one(
+                {"user_id": user_id},
+                {"$set": {"history_id": str(history_id), "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to store Gmail history checkpoint for user {user_id}: {e}")
+
+    async def stage_gmail_history_id(self, user_id: int, history_id: str) -> None:
+        """Hold a historyId until the messages fetched up to it are handled; see commit_gmail_history_id."""
+        try:
+            await self.gmail_sync_state.update_one(
+                {"user_id": user_id},
+                {"$set": {"pending_history_id": str(history_id), "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to stage Gmail history checkpoint for user {user_id}: {e}")
+
+    async def commit_gmail_history_id(self, user_id: int) -> Optional[str]:
+        """Advance the sync checkpoint to the staged historyId, if any. Returns the new checkpoint."""
+        state = await self.gmail_sync_state.find_one({"user_id": user_id}, {"_id": 0, "pending_history_id": 1})
+        pending = state.get("pending_history_id") if state else None
+        if not pending:
+            return None
+        try:
+            # Conditional on the staged value: one staged by a later fetch meanwhile stays pending
+            await self.gmail_sync_state.update_one(
+                {"user_id": user_id, "pending_history_id": pending},
+                {
+                    "$set": {"history_id": pending, "updated_at": datetime.now(timezone.utc)},
+                    "$unset": {"pending_history_id": ""}
+                }
+            )
+        except Exception as e:
+            logger.error(f"Failed to store Gmail history checkpoint for user {user_id}: {e}")
+            return None
+        return pending
+
+    async def set_gmail_watch(self, user_id: int, email_address: str, expires_at: datetime) -> None:
+        """Record an active users.watch registration (push notifications) for a user."""
+        await self.gmail_sync_state.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "watch": {"email_address": email_address.lower(), "expires_at": expires_at, "enabled": True},
+                "updated_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+
+    async def has_gmail_watch(self, user_id: int) -> bool:
+        state = await self.gmail_sync_state.find_one({"user_id": user_id, "watch.enabled": True}, {"_id": 0, "user_id": 1})
+        return state is not None
+
+    async def clear_gmail_watch(self, user_id: int) -> None:
+        await self.gmail_sync_state.update_one({"user_id": user_id}, {"$unset": {"watch": ""}})
+
+    async def get_gmail_watch_user(self, email_address: str) -> Optional[int]:
+        """User whose active Gmail watch belongs to the mailbox address in a push notification."""
+        state = await self.gmail_sync_state.find_one(
+            {"watch.email_address": email_address.lower(), "watch.enabled": True},
+            {"_id": 0, "user_id": 1}
+        )
+        return state["user_id"] if state else None
+
+    async def get_expiring_gmail_watches(self, before: datetime) -> List[int]:
+        """Users whose Gmail watch expires before `before`."""
+        cursor = self.gmail_sync_state.find(
+            {"watch.enabled": True, "watch.expires_at": {"$lt": before}},
+            {"_id": 0, "user_id": 1}
+        )
+        return [state["user_id"] async for state in cursor]
+
+    # Processed-message ledger
+    async def filter_unprocessed_messages(self, user_id: int, message_ids: List[str]) -> List[str]:
+        """The subset of message_ids (in order) that still needs handling for the user.
+
+        That is messages without a ledger entry, plus those whose last action failed fewer
+        than PROCESSED_MESSAGE_MAX_FAILURES times, so they are retried on later runs.
+        """
+        if not message_ids:
+            return []
+        try:
+            cursor = self.processed_messages.find(
+                {"user_id": user_id, "message_id": {"$in": list(message_ids)}},
+                {"_id": 0, "message_id": 1, "failed": 1, "failures": 1}
+            )
+            processed = {
+                doc["message_id"] async for doc in cursor
+                if not doc.get("failed") or doc.get("failures", 0) >= PROCESSED_MESSAGE_MAX_FAILURES
+            }
+        except Exception as e:
+            logger.error(f"Failed to read processed messages for user {user_id}: {e}")
+            return list(message_ids)
+        return [message_id for message_id in message_ids if message_id not in processed]
+
+    async def record_processed_message(
+        self,
+        user_id: int,
+        message_id: str,
+        score: Optional[float] = None,
+        action: Optional[str] = None,
+        failed: bool = False
+    ) -> Optional[int]:
+        """Record how a message was handled. Returns its failure count when `failed`, else None."""
+        try:
+            now = datetime.now(timezone.utc)
+            update: Dict[str, Any] = {
+                "$set": {"score": score, "action": action, "failed": failed, "processed_at": now},
+                "$setOnInsert": {"first_processed_at": now}
+            }
+            if failed:
+                update["$inc"] = {"failures": 1}
+            entry = await self.processed_messages.find_one_and_update(
+                {"user_id": user_id, "message_id": message_id},
+                update,
+                projection={"_id": 0, "failures": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return entry.get("failures", 0) if failed and entry else None
+        except Exception as e:
+            logger.error(f"Failed to record processed message {message_id} for user {user_id}: {e}")
+            return None
+
+    # Outbound reply queue
+    async def enqueue_outbound_reply(self, reply: Dict[str, Any]) -> bool:
+        """Queue a reply unless one with the same idempotency_key exists. Returns True if it was queued."""
+        now = datetime.now(timezone.utc)
+        document = {
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+            **reply
+        }
+        try:
+            result = await self.outbound_replies.update_one(
+                {"idempotency_key": reply["idempotency_key"]},
+                {"$setOnInsert": document},
+                upsert=True
+            )
+            return result.upserted_id is not None
+        except DuplicateKeyError:
+            # A concurrent enqueue for the same key won the upsert
+            return False
+
+    async def claim_outbound_replies(self, limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+        """Lease up to `limit` due replies for sending, oldest due first.
+
+        Replies stuck in "sending" past their lease (a sender that died mid-batch) are
+        claimed again.
+        """
+        now = datetime.now(timezone.utc)
+        due = {"$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "lease_until": {"$lte": now}},
+        ]}
+        cursor = self.outbound_replies.find(due, {"_id": 1}).sort("next_attempt_at", ASCENDING).limit(limit)
+        claimed = []
+        async for candidate in cursor:
+            # Conditional update so two senders never lease the same reply
+            reply = await self.outbound_replies.find_one_and_update(
+                {"_id": candidate["_id"], **due},
+                {"$set": {"status": "sending", "lease_until": now + timedelta(seconds=lease_seconds)}},
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            if reply:
+                claimed.append(reply)
+        return claimed
+
+    async def update_outbound_reply(self, idempotency_key: str, fields: Dict[str, Any], inc_attempts: bool = False) -> None:
+        update: Dict[str, Any] = {"$set": {**fields, "updated_at": datetime.now(timezone.utc)}, "$unset": {"lease_until": ""}}
+        if inc_attempts:
+            update["$inc"] = {"attempts": 1}
+        try:
+            await self.outbound_replies.update_one({"idempotency_key": idempotency_key}, update)
+        except Exception as e:
+            logger.error(f"Failed to update outbound reply {idempotency_key}: {e}")
+
     async def close(self):
-        """Close the MongoDB connection."""
-        if self.client:
-            self.client.close()
-            logger.info("Closed MongoDB connection")
+        """Flush pending execution logs and close the MongoDB connection."""
+        try:
+            await self.log_rollup.stop()
+            await self.log_writer.stop()
+        except Exception as e:
+            logger.error(f"Failed to flush execution logs on close: {e}")
+        self.registry.close()
+        logger.info("Closed MongoDB connection")
 
 def get_mongo_db():
-    if not hasattr(_local, "mongo_db"):
-        _local.mongo_db = MongoManager(db_name="crewai_scheduler")
-        # Add cleanup on program exit
-        import atexit
-        atexit.register(lambda: asyncio.run(_local.mongo_db.close()))
-    return _local.mongo_db
\ No newline at end of file
+    """Process-wide MongoManager; all components share its client registry."""
+    global _mongo_db
+    if _mongo_db is None:
+        with _mongo_db_lock:
+            if _mongo_db is None:
+                _mongo_db = MongoManager(db_name="crewai_scheduler")
+                # Add cleanup on program exit
+                import atexit
+                atexit.register(lambda: asyncio.run(_mongo_db.close()))
+    return _mongo_db
\ No newline at end of file
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_LOG_RETENTION_DAYS = float(os.getenv("EXECUTION_LOG_RETENTION_DAYS", "30"))
+EXECUTION_LOG_ROLLUP_INTERVAL = float(os.getenv("EXECUTION_LOG_ROLLUP_INTERVAL", "300"))
+# Hours of raw logs re-aggregated on each rollup pass, so late writes still land in their bucket
+EXECUTION_LOG_ROLLUP_LOOKBACK_HOURS = int(os.getenv("EXECUTION_LOG_ROLLUP_LOOKBACK_HOURS", "2"))
+
+EXECUTION_LOGS = "execution_logs"
+EXECUTION_LOG_ROLLUPS = "execution_log_rollups"
+
+def _to_utc(value: Any) -> datetime:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = None
+    if not isinstance(value, datetime):
+        return datetime.now(timezone.utc)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def normalize_execution_log(log_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a log entry for the time-series layout.
+
+    The timestamp always becomes a UTC datetime, and user_id, crew_id and status
+    move into the `meta` field that MongoDB buckets on.
+    """
+    doc = dict(log_data)
+    meta = dict(doc.pop("meta", {}) or {})
+    meta.setdefault("user_id", doc.pop("user_id", None))
+    meta.setdefault("crew_id", doc.pop("crew_id", None))
+    meta.setdefault("status", "error" if doc.get("error") else "success")
+    doc["meta"] = meta
+    doc["timestamp"] = _to_utc(doc.get("timestamp"))
+    return doc
+
+async def ensure_execution_log_collection(db, retention_days: float = EXECUTION_LOG_RETENTION_DAYS) -> None:
+    """Create execution_logs as a time-series collection, or update its retention."""
+    expire_after = int(retention_days * 86400) if retention_days > 0 else None
+    try:
+        existing = await db.list_collections(filter={"name": EXECUTION_LOGS}).to_list(length=1)
+        if not existing:
+            options: Dict[str, Any] = {
+                "timeseries": {"timeField": "timestamp", "metaField": "meta", "granularity": "minutes"}
+            }
+            if expire_after:
+                options["expireAfterSeconds"] = expire_after
+            await db.create_collection(EXECUTION_LOGS, **options)
+            logger.info(f"Created time-series collection {EXECUTION_LOGS} (retention={expire_after}s)")
+        elif existing[0].get("type") == "timeseries":
+            await db.command("collMod", EXECUTION_LOGS, expireAfterSeconds=expire_after or "off")
+            logger.info(f"Set {EXECUTION_LOGS} retention to {expire_after or 'off'}")
+        else:
+            logger.warning(
+                f"{EXECUTION_LOGS} is a regular collection; migrate it to a time-series collection "
+                f"to enable retention and bucketed storage"
+            )
+    except Exception as e:
+        logger.error(f"Failed to set up {EXECUTION_LOGS} collection: {e}")
+
+class ExecutionLogRollup:
+    """Periodically aggregates raw execution logs into hourly per-user/per-crew buckets."""
+
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        interval: float = EXECUTION_LOG_ROLLUP_INTERVAL,
+        lookback_hours: int = EXECUTION_LOG_ROLLUP_LOOKBACK_HOURS
+    ):
+        self._get_db = get_db
+        self.interval = interval
+        self.lookback_hours = max(1, lookback_hours)
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self, since: Optional[datetime] = None) -> int:
+        """Recompute every hourly bucket from `since` (default: the lookback window). Returns buckets written."""
+        if since is None:
+            now = datetime.now(timezone.utc)
+            since = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=self.lookback_hours - 1)
+        pipeline: List[Dict[str, Any]] = [
+            {"$match": {"timestamp": {"$gte": since}}},
+            {"$group": {
+                "_id": {
+                    "user_id": "$meta.user_id",
+                    "crew_id": "$meta.crew_id",
+                    "hour": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}}
+                },
+                "runs": {"$sum": 1},
+                "errors": {"$sum": {"$cond": [{"$eq": ["$meta.status", "error"]}, 1, 0]}},
+                "total_duration_ms": {"$sum": {"$ifNull": ["$duration_ms", 0]}},
+                "max_duration_ms": {"$max": "$duration_ms"}
+            }}
+        ]
+        db = self._get_db()
+        updated_at = datetime.now(timezone.utc)
+        operations = []
+        async for bucket in db[EXECUTION_LOGS].aggregate(pipeline):
+            key = bucket.pop("_id")
+            operations.append(ReplaceOne(key, {**key, **bucket, "updated_at": updated_at}, upsert=True))
+        if operations:
+            await db[EXECUTION_LOG_ROLLUPS].bulk_write(operations, ordered=False)
+        logger.debug(f"Rolled up {len(operations)} execution log buckets since {since}")
+        return len(operations)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info("Started execution log rollup")
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            logger.info("Stopped execution log rollup")
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Execution log rollup failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,116 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Declarative index layout for every collection the app queries.
+# Each entry is a list of (key, direction) pairs plus IndexModel options.
+INDEX_SPECS: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+        {"keys": [("email", ASCENDING)], "unique": True},
+    ],
+    "crews": [
+        {"keys": [("crew_id", ASCENDING)], "unique": True},
+        {"keys": [("user_id", ASCENDING), ("crew_type", ASCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("crew_id", ASCENDING)]},
+    ],
+    "oauth_states": [
+        {"keys": [("state", ASCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("service", ASCENDING)], "unique": True},
+        # Let MongoDB purge expired states instead of relying on get_oauth_state cleanup
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "execution_logs": [
+        {"keys": [("meta.user_id", ASCENDING), ("timestamp", DESCENDING)]},
+    ],
+    "execution_log_rollups": [
+        {"keys": [("user_id", ASCENDING), ("crew_id", ASCENDING), ("hour", ASCENDING)], "unique": True},
+        {"keys": [("user_id", ASCENDING), ("hour", DESCENDING)]},
+    ],
+    "gmail_sync_state": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+        {"keys": [("watch.email_address", ASCENDING)]},
+        {"keys": [("watch.expires_at", ASCENDING)]},
+    ],
+    "processed_messages": [
+        {"keys": [("user_id", ASCENDING), ("message_id", ASCENDING)], "unique": True},
+    ],
+    "outbound_replies": [
+        {"keys": [("idempotency_key", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING), ("next_attempt_at", ASCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "jobs": [
+        {"keys": [("job_id", ASCENDING)], "unique": True},
+        {"keys": [("status", ASCENDING)]},
+        {"keys": [("next_run", ASCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("job_id", ASCENDING)]},
+    ],
+}
+
+def _key_of(keys) -> Tuple[Tuple[str, int], ...]:
+    return tuple((field, int(direction)) for field, direction in keys)
+
+def _options_of(spec: Dict[str, Any]) -> Dict[str, Any]:
+    options = {}
+    if spec.get("unique"):
+        options["unique"] = True
+    if spec.get("expireAfterSeconds") is not None:
+        options["expireAfterSeconds"] = int(spec["expireAfterSeconds"])
+    return options
+
+class IndexManager:
+    """Creates the declared indexes and reports drift against what exists in MongoDB."""
+
+    def __init__(self, db, specs: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        self.db = db
+        self.specs = specs if specs is not None else INDEX_SPECS
+
+    async def ensure_indexes(self, collections: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+        """Create declared indexes. Failures are logged per index so startup is not blocked."""
+        created: Dict[str, List[str]] = {}
+        for name in collections or self.specs.keys():
+            for spec in self.specs.get(name, []):
+                model = IndexModel(spec["keys"], **{k: v for k, v in spec.items() if k != "keys"})
+                try:
+                    # One command per index so a single conflict does not block the rest
+                    created.setdefault(name, []).extend(await self.db[name].create_indexes([model]))
+                except Exception as e:
+                    logger.error(f"Failed to create index {spec['keys']} on {name}: {e}")
+            if created.get(name):
+                logger.info(f"Ensured indexes on {name}: {created[name]}")
+        return created
+
+    async def report(self) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+        """Compare declared and existing indexes.
+
+        Returns {collection: {"missing": [...], "extra": [...], "conflicting": [...]}}
+        for every collection that has drifted.
+        """
+        drift: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        for name, specs in self.specs.items():
+            existing: Dict[Tuple[Tuple[str, int], ...], Dict[str, Any]] = {}
+            try:
+                async for index in self.db[name].list_indexes():
+                    if index["name"] == "_id_":
+                        continue
+                    existing[_key_of(index["key"].items())] = index
+            except Exception as e:
+                logger.error(f"Failed to list indexes on {name}: {e}")
+                continue
+
+            missing, conflicting = [], []
+            for spec in specs:
+                key = _key_of(spec["keys"])
+                index = existing.pop(key, None)
+                if index is None:
+                    missing.append({"keys": list(key), **_options_of(spec)})
+                elif _options_of(index) != _options_of(spec):
+                    conflicting.append({"name": index["name"], "expected": _options_of(spec), "actual": _options_of(index)})
+            extra = [{"name": index["name"], "keys": list(key)} for key, index in existing.items()]
+
+            if missing or extra or conflicting:
+                drift[name] = {"missing": missing, "extra": extra, "conflicting": conflicting}
+        return drift
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "50"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "2"))
+LOG_BUFFER_CAPACITY = int(os.getenv("LOG_BUFFER_CAPACITY", "1000"))
+
+class ExecutionLogWriter:
+    """Buffers execution log documents and writes them with insert_many.
+
+    Documents are flushed when `batch_size` is reached or every
+    `flush_interval` seconds by the background task. Once the buffer holds
+    `capacity` documents, writers wait for a flush before appending
+    (backpressure). stop() always drains the buffer.
+    """
+
+    def __init__(
+        self,
+        get_collection: Callable[[], Any],
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        capacity: int = LOG_BUFFER_CAPACITY
+    ):
+        self._get_collection = get_collection
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.capacity = max(self.batch_size, capacity)
+        self._buffer: deque = deque()
+        # Jobs log from worker threads with their own event loops, so guard the buffer with a thread lock
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    async def write(self, log_data: Dict[str, Any]) -> None:
+        if self.pending() >= self.capacity:
+            logger.warning(f"Execution log buffer full ({self.capacity}); flushing inline")
+            await self.flush()
+
+        with self._lock:
+            if len(self._buffer) >= self.capacity:
+                # Flush failed and the buffer is still full; drop the oldest entry
+                self._buffer.popleft()
+                logger.error("Execution log buffer overflow; dropped oldest log entry")
+            self._buffer.append(log_data)
+            size = len(self._buffer)
+
+        if size >= self.batch_size:
+            if self.running:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            else:
+                await self.flush()
+
+    async def flush(self) -> int:
+        """Write every buffered document. Returns the number of documents written."""
+        with self._lock:
+            if not self._buffer:
+                return 0
+            batch = list(self._buffer)
+            self._buffer.clear()
+
+        try:
+            await self._get_collection().insert_many(batch, ordered=False)
+            logger.debug(f"Flushed {len(batch)} execution logs")
+            return len(batch)
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to flush {len(batch)} execution logs: {e}")
+            with self._lock:
+                room = self.capacity - len(self._buffer)
+                if room < len(batch):
+                    logger.error(f"Dropping {len(batch) - max(room, 0)} execution logs after failed flush")
+                if room > 0:
+                    # Put the failed batch back in front so ordering is preserved
+                    self._buffer.extendleft(reversed(batch[-room:]))
+            return 0
+
+    def start(self) -> None:
+        """Start the periodic flusher on the running event loop."""
+        if self.running:
+            return
+        self._stopping = False
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+        logger.info("Started execution log writer")
+
+    async def stop(self) -> None:
+        """Stop the periodic flusher and drain the buffer."""
+        if self.running:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            logger.info("Stopped execution log writer")
+        self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
@@ -0,0 +1,557 @@
+"""In-process stand-in for the subset of MongoDB that MongoManager uses.
+
+Selected with MONGO_BACKEND=memory. It keeps documents in Python lists so the app's own
+overhead can be profiled without database latency. Not a full MongoDB emulation: it
+supports equality, comparison, $in/$nin/$exists/$ne, $or/$and filters, the $set, $unset,
+$inc, $setOnInsert and $push update operators, simple projections, sorting and unique
+indexes. TTL indexes are recorded but documents are never expired, and aggregation is
+not supported.
+"""
+import asyncio
+import copy
+import logging
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+def _bsonify(value: Any) -> Any:
+    """Copy a value the way a BSON round-trip would (naive UTC datetimes, millisecond precision)."""
+    if isinstance(value, dict):
+        return {k: _bsonify(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_bsonify(v) for v in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+def _get_path(doc: Any, path: str) -> Any:
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+    return value
+
+def _set_path(doc: Dict, path: str, value: Any) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+def _unset_path(doc: Dict, path: str) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+def _type_rank(value: Any) -> int:
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    rank = _type_rank(value)
+    if rank in (1,):
+        return (rank, 0)
+    if rank in (4, 5):
+        return (rank, repr(value))
+    return (rank, value)
+
+def _compare(op: str, actual: Any, expected: Any) -> bool:
+    # MongoDB only compares values of the same type bracket
+    if actual is _MISSING or _type_rank(actual) != _type_rank(expected):
+        return False
+    try:
+        if op == "$gt":
+            return actual > expected
+        if op == "$gte":
+            return actual >= expected
+        if op == "$lt":
+            return actual < expected
+        if op == "$lte":
+            return actual <= expected
+    except TypeError:
+        return False
+    raise OperationFailure(f"Unsupported comparison operator {op}")
+
+def _equals(actual: Any, expected: Any) -> bool:
+    if actual is _MISSING:
+        return expected is None
+    if isinstance(actual, list) and not isinstance(expected, list):
+        return expected in actual
+    return actual == expected
+
+def _match_condition(actual: Any, condition: Any) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, expected in condition.items():
+            expected = _bsonify(expected)
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if not _compare(op, actual, expected):
+                    return False
+            elif op == "$eq":
+                if not _equals(actual, expected):
+                    return False
+            elif op == "$ne":
+                if _equals(actual, expected):
+                    return False
+            elif op == "$in":
+                if not any(_equals(actual, item) for item in expected):
+                    return False
+            elif op == "$nin":
+                if any(_equals(actual, item) for item in expected):
+                    return False
+            elif op == "$exists":
+                if (actual is not _MISSING) != bool(expected):
+                    return False
+            elif op == "$regex":
+                if not isinstance(actual, str) or not re.search(expected, actual):
+                    return False
+            else:
+                raise OperationFailure(f"Unsupported query operator {op}")
+        return True
+    return _equals(actual, _bsonify(condition))
+
+def _matches(doc: Dict, query: Optional[Dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(_matches(doc, sub) for sub in condition):
+                return False
+        elif not _match_condition(_get_path(doc, key), condition):
+            return False
+    return True
+
+def _project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(bool(v) for v in fields.values()):
+        projected: Dict[str, Any] = {}
+        for path in fields:
+            value = _get_path(doc, path)
+            if value is not _MISSING:
+                _set_path(projected, path, value)
+        if include_id and "_id" in doc:
+            projected["_id"] = doc["_id"]
+        return projected
+    for path, keep in fields.items():
+        if not keep:
+            _unset_path(doc, path)
+    if not include_id:
+        doc.pop("_id", None)
+    return doc
+
+def _apply_update(doc: Dict, update: Dict, inserting: bool) -> None:
+    if not any(k.startswith("$") for k in update):
+        # Replacement document
+        _id = doc.get("_id")
+        doc.clear()
+        doc.update(_bsonify(update))
+        if _id is not None:
+            doc.setdefault("_id", _id)
+        return
+    for op, fields in update.items():
+        fields = _bsonify(fields)
+        if op == "$set":
+            for path, value in fields.items():
+                _set_path(doc, path, value)
+        elif op == "$setOnInsert":
+            if inserting:
+                for path, value in fields.items():
+                    _set_path(doc, path, value)
+        elif op == "$unset":
+            for path in fields:
+                _unset_path(doc, path)
+        elif op == "$inc":
+            for path, amount in fields.items():
+                current = _get_path(doc, path)
+                _set_path(doc, path, (0 if current is _MISSING else current) + amount)
+        elif op == "$push":
+            for path, value in fields.items():
+                current = _get_path(doc, path)
+                items = [] if current is _MISSING else list(current)
+                if isinstance(value, dict) and "$each" in value:
+                    items.extend(value["$each"])
+                else:
+                    items.append(value)
+                _set_path(doc, path, items)
+        else:
+            raise OperationFailure(f"Unsupported update operator {op}")
+
+def _seed_from_query(query: Optional[Dict]) -> Dict:
+    """Equality fields of a query become the base of an upserted document."""
+    seed: Dict[str, Any] = {}
+    for key, condition in (query or {}).items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                _set_path(seed, key, _bsonify(condition["$eq"]))
+            continue
+        _set_path(seed, key, _bsonify(condition))
+    return seed
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query: Optional[Dict], projection: Optional[Dict]):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[List[Dict]] = None
+
+    def sort(self, key_or_list, direction: int = 1) -> "MemoryCursor":
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    def _materialize(self) -> List[Dict]:
+        if self._results is None:
+            docs = self._collection._select(self._query)
+            for key, direction in reversed(self._sort):
+                docs.sort(key=lambda d: _sort_key(_get_path(d, key)), reverse=direction < 0)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            self._results = [_project(d, self._projection) for d in docs]
+        return self._results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._materialize():
+            yield doc
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict]:
+        docs = self._materialize()
+        return list(docs if length is None else docs[:length])
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: List[Dict] = []
+        self._indexes: Dict[str, Dict[str, Any]] = {"_id_": {"name": "_id_", "key": {"_id": 1}, "unique": True}}
+        self._lock = threading.RLock()
+
+    # Internal helpers; callers hold self._lock
+
+    def _select(self, query: Optional[Dict]) -> List[Dict]:
+        with self._lock:
+            return [d for d in self._docs if _matches(d, query)]
+
+    def _check_unique(self, candidate: Dict, ignore: Optional[Dict] = None) -> None:
+        for index in self._indexes.values():
+            if not index.get("unique"):
+                continue
+            fields = list(index["key"].keys())
+            key = tuple(_get_path(candidate, f) for f in fields)
+            key = tuple(None if v is _MISSING else v for v in key)
+            for doc in self._docs:
+                if doc is ignore:
+                    continue
+                other = tuple(None if v is _MISSING else v for v in (_get_path(doc, f) for f in fields))
+                if other == key:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.database.name}.{self.name} "
+                        f"index: {index['name']} dup key: {dict(zip(fields, key))}"
+                    )
+
+    def _insert(self, document: Dict) -> Any:
+        doc = _bsonify(document)
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self._docs.append(doc)
+        # pymongo sets _id on the caller's document
+        document.setdefault("_id", doc["_id"])
+        return doc["_id"]
+
+    def _update(self, query: Dict, update: Dict, upsert: bool, multi: bool) -> Tuple[int, int, Any, Optional[Dict], Optional[Dict]]:
+        """Returns (matched, modified, upserted_id, before, after) for the first document touched."""
+        matched = [d for d in self._docs if _matches(d, query)]
+        if not multi:
+            matched = matched[:1]
+        if not matched:
+            if not upsert:
+                return 0, 0, None, None, None
+            doc = _seed_from_query(query)
+            _apply_update(doc, update, inserting=True)
+            if "_id" not in doc:
+                doc["_id"] = ObjectId()
+            self._check_unique(doc)
+            self._docs.append(doc)
+            return 0, 0, doc["_id"], None, doc
+
+        modified = 0
+        first_before = first_after = None
+        for doc in matched:
+            before = copy.deepcopy(doc)
+            updated = copy.deepcopy(doc)
+            _apply_update(updated, update, inserting=False)
+            self._check_unique(updated, ignore=doc)
+            if updated != doc:
+                modified += 1
+                doc.clear()
+                doc.update(updated)
+            if first_before is None:
+                first_before, first_after = before, doc
+        return len(matched), modified, None, first_before, first_after
+
+    # Public API (async to match Motor)
+
+    async def find_one(self, filter: Optional[Dict] = None, projection: Optional[Dict] = None, **kwargs) -> Optional[Dict]:
+        with self._lock:
+            for doc in self._docs:
+                if _matches(doc, filter):
+                    return _project(doc, projection)
+        return None
+
+    def find(self, filter: Optional[Dict] = None, projection: Optional[Dict] = None, **kwargs) -> MemoryCursor:
+        return MemoryCursor(self, filter, projection)
+
+    async def count_documents(self, filter: Optional[Dict] = None, **kwargs) -> int:
+        return len(self._select(filter))
+
+    async def insert_one(self, document: Dict, **kwargs) -> InsertOneResult:
+        with self._lock:
+            return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: Iterable[Dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        inserted_ids = []
+        errors = []
+        with self._lock:
+            for document in documents:
+                try:
+                    inserted_ids.append(self._insert(document))
+                except DuplicateKeyError as e:
+                    if ordered:
+                        raise
+                    errors.append(e)
+        if errors:
+            raise errors[0]
+        return InsertManyResult(inserted_ids, True)
+
+    async def update_one(self, filter: Dict, update: Dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        with self._lock:
+            matched, modified, upserted_id, _, _ = self._update(filter, update, upsert, multi=False)
+        raw = {"n": matched or (1 if upserted_id is not None else 0), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def update_many(self, filter: Dict, update: Dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        with self._lock:
+            matched, modified, upserted_id, _, _ = self._update(filter, update, upsert, multi=True)
+        raw = {"n": matched or (1 if upserted_id is not None else 0), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def replace_one(self, filter: Dict, replacement: Dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return await self.update_one(filter, replacement, upsert=upsert)
+
+    async def find_one_and_update(
+        self,
+        filter: Dict,
+        update: Dict,
+        projection: Optional[Dict] = None,
+        upsert: bool = False,
+        return_document: bool = False,
+        **kwargs
+    ) -> Optional[Dict]:
+        with self._lock:
+            _, _, upserted_id, before, after = self._update(filter, update, upsert, multi=False)
+            if upserted_id is not None:
+                return _project(after, projection) if return_document else None
+            if after is None:
+                return None
+            return _project(after if return_document else before, projection)
+
+    async def delete_one(self, filter: Dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            for i, doc in enumerate(self._docs):
+                if _matches(doc, filter):
+                    del self._docs[i]
+                    return DeleteResult({"n": 1}, True)
+        return DeleteResult({"n": 0}, True)
+
+    async def delete_many(self, filter: Dict, **kwargs) -> DeleteResult:
+        with self._lock:
+            before = len(self._docs)
+            self._docs = [d for d in self._docs if not _matches(d, filter)]
+            return DeleteResult({"n": before - len(self._docs)}, True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, **kwargs) -> BulkWriteResult:
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": []}
+        for i, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+                counts["nInserted"] += 1
+            elif isinstance(request, (ReplaceOne, UpdateOne, UpdateMany)):
+                method = self.update_many if isinstance(request, UpdateMany) else self.update_one
+                result = await method(request._filter, request._doc, upsert=bool(request._upsert))
+                counts["nMatched"] += result.matched_count
+                counts["nModified"] += result.modified_count
+                if result.upserted_id is not None:
+                    counts["nUpserted"] += 1
+                    counts["upserted"].append({"index": i, "_id": result.upserted_id})
+            elif isinstance(request, DeleteOne):
+                counts["nRemoved"] += (await self.delete_one(request._filter)).deleted_count
+            else:
+                raise OperationFailure(f"Unsupported bulk operation {type(request).__name__}")
+        return BulkWriteResult(counts, True)
+
+    async def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        key = {field: direction for field, direction in keys}
+        name = name or "_".join(f"{field}_{direction}" for field, direction in key.items())
+        with self._lock:
+            existing = self._indexes.get(name)
+            if existing and (existing["key"] != key or bool(existing.get("unique")) != bool(unique)):
+                raise OperationFailure(f"Index with name {name} already exists with different options")
+            index = {"name": name, "key": key, **kwargs}
+            if unique:
+                index["unique"] = True
+                probe = MemoryCollection(self.database, self.name)
+                probe._indexes = {name: index}
+                for doc in self._docs:
+                    probe._check_unique(doc)
+                    probe._docs.append(doc)
+            self._indexes[name] = index
+        return name
+
+    async def create_indexes(self, models: List[Any], **kwargs) -> List[str]:
+        names = []
+        for model in models:
+            document = dict(model.document)
+            key = list(document.pop("key").items())
+            names.append(await self.create_index(key, **document))
+        return names
+
+    def list_indexes(self) -> MemoryCursor:
+        indexes = MemoryCollection(self.database, f"{self.name}.indexes")
+        indexes._docs = [copy.deepcopy(index) for index in self._indexes.values()]
+        return MemoryCursor(indexes, None, None)
+
+    def aggregate(self, pipeline: List[Dict], **kwargs):
+        raise OperationFailure("aggregate is not supported by the in-memory backend")
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+        self._options: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = self._collections[name] = MemoryCollection(self, name)
+            return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        with self._lock:
+            return list(self._collections.keys())
+
+    def list_collections(self, filter: Optional[Dict] = None, **kwargs) -> MemoryCursor:
+        catalog = MemoryCollection(self, "$catalog")
+        with self._lock:
+            catalog._docs = [
+                {"name": name, "type": self._options.get(name, {}).get("type", "collection"), "options": self._options.get(name, {})}
+                for name in self._collections
+            ]
+        return MemoryCursor(catalog, filter, None)
+
+    async def create_collection(self, name: str, **options) -> MemoryCollection:
+        with self._lock:
+            if name in self._collections:
+                raise OperationFailure(f"Collection {self.name}.{name} already exists")
+            self._options[name] = {"type": "timeseries" if "timeseries" in options else "collection", **options}
+        return self[name]
+
+    async def command(self, command, *args, **kwargs) -> Dict[str, Any]:
+        return {"ok": 1.0}
+
+class MemoryClient:
+    """Drop-in for AsyncIOMotorClient; usable from any event loop or thread."""
+
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        with self._lock:
+            database = self._databases.get(name)
+            if database is None:
+                database = self._databases[name] = MemoryDatabase(self, name)
+            return database
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_io_loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_event_loop()
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, List, Optional
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "100"))
+
+class IdBlockAllocator:
+    """Hands out sequence IDs from ranges reserved on the `counters` collection.
+
+    Each refill does a single `$inc` of `block_size` on the counter document, which
+    reserves the range (seq - block_size, seq] for this process. IDs are unique across
+    processes and monotonic within a process; unused IDs in a block become gaps.
+    """
+
+    def __init__(self, block_size: int = ID_BLOCK_SIZE):
+        self.block_size = max(1, block_size)
+        # name -> [next_id, last_id] of the block currently being handed out
+        self._blocks: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+        # Per event loop refill locks so concurrent callers on one loop share a single round-trip
+        self._refill_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Lock]]" = weakref.WeakKeyDictionary()
+
+    def _take(self, name: str) -> Optional[int]:
+        block = self._blocks.get(name)
+        if block and block[0] <= block[1]:
+            value = block[0]
+            block[0] += 1
+            return value
+        return None
+
+    def _refill_lock(self, name: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            locks = self._refill_locks.setdefault(loop, {})
+            return locks.setdefault(name, asyncio.Lock())
+
+    async def next_id(self, counters, name: str) -> int:
+        while True:
+            with self._lock:
+                value = self._take(name)
+            if value is not None:
+                return value
+
+            async with self._refill_lock(name):
+                with self._lock:
+                    value = self._take(name)
+                if value is not None:
+                    return value
+                await self._refill(counters, name)
+
+    async def _refill(self, counters, name: str) -> None:
+        result = await counters.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"seq": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        last_id = result["seq"]
+        first_id = last_id - self.block_size + 1
+        with self._lock:
+            current = self._blocks.get(name)
+            # A refill from another thread may already have installed a newer block;
+            # keep the higher one so IDs never go backwards
+            if current is None or first_id > current[1]:
+                self._blocks[name] = [first_id, last_id]
+        logger.debug(f"Reserved {name} block {first_id}-{last_id}")
+
+    def reset(self) -> None:
+        """Drop locally reserved blocks (the unused IDs become gaps)."""
+        with self._lock:
+            self._blocks.clear()
+
+id_allocator = IdBlockAllocator()
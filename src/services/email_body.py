@@ -0,0 +1,208 @@
+import base64
+import html as html_lib
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+from html2text import HTML2Text
+
+logger = logging.getLogger(__name__)
+
+# Characters decoded per MIME part; larger parts (multi-MB newsletters) are cut before conversion
+EMAIL_PART_MAX_CHARS = int(os.getenv("EMAIL_PART_MAX_CHARS", "100000"))
+# Characters kept of the final cleaned body
+EMAIL_BODY_MAX_CHARS = int(os.getenv("EMAIL_BODY_MAX_CHARS", "20000"))
+# HTML parts up to this size that only use paragraph/line-break/span markup skip HTML2Text
+EMAIL_SIMPLE_HTML_MAX_CHARS = int(os.getenv("EMAIL_SIMPLE_HTML_MAX_CHARS", "10000"))
+
+# clean_email_body passes as (pattern, replacement, substring - or tuple of substrings, one of
+# which - must be present for the pattern to match). Separate compiled passes keep the regex engine's literal-prefix scan,
+# which a single merged alternation loses, and the guards skip passes that cannot apply.
+_CLEAN_PASSES = [
+    # HTML remnants
+    (re.compile(r"<[^>]+>"), "", "<"),
+    # Preserve important separators
+    (re.compile(r"\n-{4,}\s*"), "\n---\n", "----"),
+    # Tracking links
+    (re.compile(r"https?://[^\s)]*(?i:tracking|utm_)[^\s)]*"), "", "://"),
+    # Common signatures: "--" delimiter, "Sent from my ...", sign-offs with the next line, phone numbers
+    (re.compile(r"^\s*--\s*$.*", re.MULTILINE), "", "--"),
+    (re.compile(r"\nSent from my .+\n", re.IGNORECASE), "", None),
+    (re.compile(r"\n(?:Best regards|Sincerely|Cheers),\n.*", re.IGNORECASE), "", ","),
+    (re.compile(r"\n\d{3}-\d{3}-\d{4}"), "", "-"),
+    # Normalize whitespace; single spaces are left alone instead of being rewritten one by one
+    (re.compile(r"\t[ \t]*| [ \t]+"), " ", ("\t", "  ")),
+    (re.compile(r"\n{3,}"), "\n\n", "\n\n\n"),
+]
+_NEWLINES_RE = re.compile(r"[\r\n]+")
+# Quoted history in replies: "> " lines, and everything from the first reply header on
+_QUOTED_LINE_RE = re.compile(r"^[ \t]*>.*(?:\n|$)", re.MULTILINE)
+_REPLY_HEADER_RE = re.compile(
+    r"^[ \t]*(?:On [^\n]{0,200}(?:\n[^\n]{0,200})?wrote:|-{2,}\s*Original Message\s*-{2,}|From: [^\n]+\n(?:Sent|Date): )",
+    re.MULTILINE | re.IGNORECASE
+)
+_BLANK_RUN_RE = re.compile(r"\n{3,}")
+_ELLIPSIS_RE = re.compile(r"\.{5,}")
+_HTML_TAG_RE = re.compile(r"<(/?[^\s/>]*)[^>]*>")
+_HTML_SPACE_RE = re.compile(r"\s+")
+_SPACE_BEFORE_NEWLINE_RE = re.compile(r" +\n")
+_SIMPLE_BLOCK_TAGS = frozenset(["p", "div", "center", "html", "body"])
+_SIMPLE_INLINE_TAGS = frozenset(["span", "font"])
+
+class _ReusableConverter:
+    """A configured HTML2Text that is reset to its pristine state before each document."""
+
+    def __init__(self):
+        converter = HTML2Text()
+        converter.ignore_links = False
+        converter.ignore_images = True
+        converter.ignore_tables = True
+        converter.ignore_emphasis = False
+        converter.body_width = 0  # No line wrapping
+        converter.single_line_break = True
+        self.converter = converter
+        # Immutable attributes are restored with one dict update; only containers are copied
+        self._pristine = {
+            name: value for name, value in converter.__dict__.items() if not isinstance(value, (list, dict, set))
+        }
+        self._pristine_containers = [
+            (name, value) for name, value in converter.__dict__.items() if isinstance(value, (list, dict, set))
+        ]
+
+    def handle(self, html: str) -> str:
+        state = self.converter.__dict__
+        state.clear()
+        state.update(self._pristine)
+        for name, value in self._pristine_containers:
+            state[name] = value.copy()
+        self.converter.reset()
+        return self.converter.handle(html)
+
+_local = threading.local()
+
+def _simple_html_to_text(html: str) -> Optional[str]:
+    """Text of HTML that only uses paragraph, line-break and span markup, or None for anything richer."""
+    pieces: List[str] = []
+    pos = 0
+    for match in _HTML_TAG_RE.finditer(html):
+        name = match.group(1).lstrip("/").lower()
+        if name not in _SIMPLE_BLOCK_TAGS and name not in _SIMPLE_INLINE_TAGS and name != "br":
+            return None
+        text = _HTML_SPACE_RE.sub(" ", html[pos:match.start()])
+        if not pieces or pieces[-1] == "\n":
+            text = text.lstrip()
+        if text:
+            pieces.append(text)
+        if name == "br" or (name in _SIMPLE_BLOCK_TAGS and pieces and pieces[-1] != "\n"):
+            pieces.append("\n")
+        pos = match.end()
+    text = _HTML_SPACE_RE.sub(" ", html[pos:])
+    pieces.append(text.lstrip() if not pieces or pieces[-1] == "\n" else text)
+    text = html_lib.unescape("".join(pieces)).replace("\xa0", " ")
+    return _SPACE_BEFORE_NEWLINE_RE.sub("\n", text)
+
+def html_to_text(html: str) -> str:
+    if len(html) <= EMAIL_SIMPLE_HTML_MAX_CHARS:
+        # Short plain-looking HTML (most personal mail) costs more to parse than to convert
+        text = _simple_html_to_text(html)
+        if text is not None:
+            return text
+    converter = getattr(_local, "converter", None)
+    if converter is None:
+        converter = _local.converter = _ReusableConverter()
+    return converter.handle(html)
+
+def decode_part_data(data: str, max_chars: int = EMAIL_PART_MAX_CHARS) -> str:
+    """Decode base64url body data, decoding at most max_chars bytes."""
+    if max_chars > 0:
+        limit = (max_chars + 2) // 3 * 4
+        if len(data) > limit:
+            data = data[:limit]
+    data += "=" * (-len(data) % 4)
+    return base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+
+def _collect(part: Dict, out: List[Tuple[str, str]]) -> None:
+    """Append (mime_type, base64url data) for every inline text part under `part`.
+
+    Decoding is left to the caller so alternatives that are not chosen are never decoded.
+    """
+    if part.get("filename"):
+        return  # Attachment
+    mime_type = (part.get("mimeType") or "").lower()
+    children = part.get("parts")
+    if children:
+        if mime_type == "multipart/alternative":
+            # Alternatives carry the same content; prefer plain text, else the richest (last) one
+            candidates = []
+            for child in children:
+                found: List[Tuple[str, str]] = []
+                _collect(child, found)
+                if found:
+                    candidates.append(found)
+            chosen = next((c for c in candidates if any(m == "text/plain" for m, _ in c)), None)
+            if chosen is None and candidates:
+                chosen = candidates[-1]
+            out.extend(chosen or [])
+        else:
+            for child in children:
+                _collect(child, out)
+        return
+
+    data = (part.get("body") or {}).get("data")
+    if not data or mime_type not in ("text/plain", "text/html", ""):
+        return
+    out.append((mime_type or "text/plain", data))
+
+def extract_body(payload: Optional[Dict]) -> str:
+    """Clean text body of a Gmail message payload (format="full").
+
+    Walks nested multipart trees, converts HTML parts to text and runs the shared
+    cleaning pass once over the combined result.
+    """
+    parts: List[Tuple[str, str]] = []
+    _collect(payload or {}, parts)
+    texts = []
+    for mime_type, data in parts:
+        try:
+            text = decode_part_data(data)
+        except Exception as e:
+            logger.error(f"Error decoding email part {mime_type}: {e}")
+            continue
+        if mime_type == "text/html":
+            try:
+                text = html_to_text(text)
+            except Exception as e:
+                logger.error(f"Error converting HTML email part: {e}")
+                continue
+        texts.append(text)
+    return clean_email_body("\n\n".join(texts))
+
+def clean_email_body(body: str, max_chars: int = EMAIL_BODY_MAX_CHARS) -> str:
+    """Clean email body while preserving essential content"""
+    if not body:
+        return ""
+    for pattern, replacement, guard in _CLEAN_PASSES:
+        if guard is None or (guard in body if isinstance(guard, str) else any(g in body for g in guard)):
+            body = pattern.sub(replacement, body)
+    body = body.strip()
+    if max_chars > 0 and len(body) > max_chars:
+        body = body[:max_chars]
+    return body
+
+def strip_quoted_history(body: str) -> str:
+    """The new text of a reply: drops quoted lines and everything after the first reply header."""
+    if not body:
+        return ""
+    match = _REPLY_HEADER_RE.search(body)
+    if match:
+        body = body[:match.start()]
+    if ">" in body:
+        body = _QUOTED_LINE_RE.sub("", body)
+    return _BLANK_RUN_RE.sub("\n\n", body).strip()
+
+def summarize_for_prompt(body: str, limit: int = 500) -> str:
+    """Compact a cleaned body for an LLM prompt: single newlines, short ellipses, at most `limit` chars."""
+    body = _NEWLINES_RE.sub("\n", body).strip()
+    body = _ELLIPSIS_RE.sub("...", body)
+    return (body[:limit] + "...") if len(body) > limit else body
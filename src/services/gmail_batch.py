@@ -0,0 +1,90 @@
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+# Gmail accepts up to 100 calls per batch but throttles large batches; 50 is the recommended ceiling
+GMAIL_BATCH_SIZE = max(1, min(100, int(os.getenv("GMAIL_BATCH_SIZE", "50"))))
+GMAIL_BATCH_MAX_RETRIES = int(os.getenv("GMAIL_BATCH_MAX_RETRIES", "3"))
+GMAIL_BATCH_BACKOFF = float(os.getenv("GMAIL_BATCH_BACKOFF", "0.5"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    # Transport errors (timeouts, dropped connections) fail the whole batch and are worth retrying
+    return True
+
+def batch_execute(
+    service,
+    requests: List[Any],
+    batch_size: int = GMAIL_BATCH_SIZE,
+    max_retries: int = GMAIL_BATCH_MAX_RETRIES,
+    failures: Optional[Dict[int, Exception]] = None
+) -> List[Optional[Dict[str, Any]]]:
+    """Execute Gmail API requests through batch HTTP calls.
+
+    Returns one response per request, in order. Items that fail with a 429/5xx are
+    retried in a later batch with exponential backoff; items that still fail (or fail
+    with any other error) come back as None, and their final error is stored in
+    `failures` (request index -> exception) when a dict is passed.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+    pending = list(range(len(requests)))
+    attempt = 0
+
+    while pending:
+        retry: List[int] = []
+        errors: Dict[int, Exception] = {}
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            if exception is None:
+                results[index] = response
+            else:
+                errors[index] = exception
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for index in chunk:
+                batch.add(requests[index], request_id=str(index))
+            try:
+                batch.execute()
+            except Exception as e:
+                for index in chunk:
+                    errors.setdefault(index, e)
+
+        for index, error in errors.items():
+            if is_retryable(error) and attempt < max_retries:
+                retry.append(index)
+            else:
+                logger.error(f"Gmail batch item {index} failed: {error}")
+                if failures is not None:
+                    failures[index] = error
+
+        if retry:
+            attempt += 1
+            delay = GMAIL_BATCH_BACKOFF * (2 ** (attempt - 1))
+            logger.warning(f"Retrying {len(retry)} Gmail batch items in {delay:.1f}s (attempt {attempt})")
+            time.sleep(delay + random.uniform(0, delay / 2))
+        pending = sorted(retry)
+
+    return results
+
+def batch_get_messages(service, message_ids: List[str], **get_kwargs) -> List[Optional[Dict[str, Any]]]:
+    """messages().get for each id via batch requests; None for messages that could not be fetched."""
+    messages = service.users().messages()
+    requests = [messages.get(userId="me", id=message_id, **get_kwargs) for message_id in message_ids]
+    return batch_execute(service, requests)
+
+def batch_get_threads(service, thread_ids: List[str], **get_kwargs) -> List[Optional[Dict[str, Any]]]:
+    """threads().get for each id via batch requests; None for threads that could not be fetched."""
+    threads = service.users().threads()
+    requests = [threads.get(userId="me", id=thread_id, **get_kwargs) for thread_id in thread_ids]
+    return batch_execute(service, requests)
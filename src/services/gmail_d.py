@@ -1,24 +1,17 @@
+import asyncio
 import base64
-import re
+import os
 import logging
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+import threading
+from collections import OrderedDict
 from googleapiclient.errors import HttpError
 from email.mime.text import MIMEText
+from html import unescape
+from src.services.email_body import EMAIL_BODY_MAX_CHARS, extract_body as get_email_body, strip_quoted_history
+from src.services.google_clients import google_services
+from src.services.gmail_batch import batch_get_messages, batch_get_threads
+from src.services.google_exec import execute_async, run_blocking
 from src.db.db import get_mongo_db
-from src.api.cred_cryp import decrypt_credentials ,encrypt_credentials
-from datetime import datetime, timezone
-import google.auth._helpers as google_helpers
-
-# Monkey patch Google's internal datetime handling
-_original_utcnow = google_helpers.utcnow
-
-def patched_utcnow():
-    """Return current UTC datetime with timezone awareness"""
-    return datetime.now(timezone.utc)
-
-google_helpers.utcnow = patched_utcnow
 
 
 # Configure logging
@@ -27,169 +20,527 @@ logger = logging.getLogger(__name__)
 # Define Gmail API scopes
 SCOPES_READ = ["https://www.googleapis.com/auth/gmail.readonly"]
 SCOPES_SEND = ["https://www.googleapis.com/auth/gmail.send"]
+SCOPES_MODIFY = ["https://www.googleapis.com/auth/gmail.modify"]
+
+# "incremental" fetches only messages added since the stored historyId; "full" always lists the latest messages
+GMAIL_SYNC_MODE = os.getenv("GMAIL_SYNC_MODE", "incremental").lower()
+# "metadata" fetches headers and snippet for scoring and loads bodies on demand; "full" fetches bodies up front
+GMAIL_FETCH_MODE = os.getenv("GMAIL_FETCH_MODE", "metadata").lower()
+GMAIL_BODY_CACHE_SIZE = int(os.getenv("GMAIL_BODY_CACHE_SIZE", "512"))
+# "thread" scores and replies once per conversation instead of once per message
+GMAIL_GROUP_BY = os.getenv("GMAIL_GROUP_BY", "message").lower()
+GMAIL_PAGE_SIZE = int(os.getenv("GMAIL_PAGE_SIZE", "100"))
+# Pages iter_inbox downloads ahead of its consumer
+GMAIL_PREFETCH_PAGES = int(os.getenv("GMAIL_PREFETCH_PAGES", "2"))
+# Gmail search query applied server-side when a user has not set their own, e.g.
+# "is:unread newer_than:2d -category:promotions"
+GMAIL_DEFAULT_QUERY = os.getenv("GMAIL_DEFAULT_QUERY", "").strip()
+
+# Labels written back to handled messages; an empty name disables that label
+GMAIL_PROCESSED_LABEL = os.getenv("GMAIL_PROCESSED_LABEL", "HR-Processed").strip()
+GMAIL_URGENT_LABEL = os.getenv("GMAIL_URGENT_LABEL", "HR-Urgent").strip()
+
+# Partial-response masks: Gmail returns (and we parse) only these fields
+LIST_FIELDS = "messages/id,nextPageToken"
+HISTORY_FIELDS = "history/messagesAdded/message(id,labelIds),nextPageToken,historyId"
+METADATA_FIELDS = "id,threadId,snippet,payload/headers"
+FULL_FIELDS = "id,threadId,snippet,payload"
+THREAD_FIELDS = "id,messages(id,threadId,snippet,labelIds,payload)"
+
+class MessageBodyCache:
+    """LRU keyed by (user_id, message_id). Holds cleaned message bodies, which never change."""
+
+    def __init__(self, max_size: int = GMAIL_BODY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, message_id: str):
+        with self._lock:
+            body = self._entries.get((user_id, message_id))
+            if body is not None:
+                self._entries.move_to_end((user_id, message_id))
+            return body
 
-def ensure_utc(dt: datetime) -> datetime:
-    """Ensure datetime is UTC timezone-aware"""
-    if dt.tzinfo is None:
-        return dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc)
+    def put(self, user_id: int, message_id: str, body: str) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[(user_id, message_id)] = body
+            self._entries.move_to_end((user_id, message_id))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+body_cache = MessageBodyCache()
+# Thread summaries from thread mode, keyed by the message that represents the thread
+thread_cache = MessageBodyCache()
+# threadId and Message-ID header of parsed messages, so replies land in their conversation
+reply_header_cache = MessageBodyCache()
+
+# (user_id, label name) -> Gmail label ID; labels are created once and never renamed by us.
+# An entry is dropped when Gmail rejects it (the user deleted the label), see label_messages
+_label_ids: dict = {}
+_label_ids_lock = threading.Lock()
 
 async def get_gmail_service(user_id: int, scopes=None):
     if scopes is None:
         scopes = SCOPES_READ
     
     try:
-        # Initialize MongoDB connection here
-        mongo_db = get_mongo_db()
-        
-        # Fetch user data asynchronously
-        user = await mongo_db.get_user(user_id)
-        if not user:
-            logger.error(f"User {user_id} not found")
-            return None
-        
-        encrypted_creds = getattr(user, "api_credentials", "")
-        if not encrypted_creds:
-            logger.error(f"No API credentials for user {user_id}")
-            return None
-            
-        creds_data = decrypt_credentials(encrypted_creds)
-        google_creds = creds_data.get("google", {})
-        config = google_creds.get("config", {})
-        token_data = google_creds.get("token", {})
-        
-        if not config or not token_data:
-            logger.error(f"Missing Google config/token for user {user_id}")
-            return None
-        
-        # Create credentials with expiration check
-        creds = Credentials(
-            token=token_data.get("access_token"),
-            refresh_token=token_data.get("refresh_token"),
-            token_uri=token_data.get("token_uri", "https://oauth2.googleapis.com/token"),
-            client_id=config.get("client_id"),
-            client_secret=config.get("client_secret"),
-            scopes=scopes
-        )
-        
-        # Set expiration if available
-        if "expiry" in token_data:
-            expiry_str = token_data["expiry"]
-            # Parse the string to datetime
-            if isinstance(expiry_str, str):
-                expiry = datetime.fromisoformat(expiry_str)
-                # Ensure UTC timezone
-                creds.expiry = ensure_utc(expiry)
-        
-        # Get current time in UTC
-        now = datetime.now(timezone.utc)
-        
-        # Check if token needs refresh
-        needs_refresh = False
-        if creds.expiry:
-            # Ensure expiry is UTC
-            creds.expiry = ensure_utc(creds.expiry)
-            needs_refresh = now >= creds.expiry
-        else:
-            # If no expiry, assume expired
-            needs_refresh = True
-            
-        if needs_refresh and creds.refresh_token:
-            try:
-                # Apply our UTC datetime patch before refresh
-                google_helpers.utcnow = patched_utcnow
-                
-                creds.refresh(Request())
-                logger.info(f"Refreshed Google token for user {user_id}")
-                
-                # Ensure new expiry is UTC
-                creds.expiry = ensure_utc(creds.expiry)
-                
-                # Update stored credentials
-                token_data.update({
-                    "access_token": creds.token,
-                    "expiry": creds.expiry.isoformat()
-                })
-                creds_data["google"]["token"] = token_data
-                encrypted = encrypt_credentials(creds_data)
-                
-                # Update database asynchronously
-                await mongo_db.update_user_credentials(user_id, encrypted)
-            except Exception as refresh_error:
-                logger.error(f"Token refresh failed for user {user_id}: {refresh_error}")
-                return None
-            finally:
-                # Restore original function
-                google_helpers.utcnow = _original_utcnow
-        
-        service = build('gmail', 'v1', credentials=creds)
-        logger.info(f"Built Gmail service for user {user_id}")
-        return service
+        # Cached per user and scopes; credentials are rebound on every call
+        return await google_services.get_service(user_id, 'gmail', 'v1', scopes)
         
     except Exception as e:
         logger.error(f"Error building Gmail service: {str(e)}", exc_info=True)
         return None
 
 
-async def fetch_recent_emails(user_id: int, max_results: int = 5) -> list:
+async def list_inbox_page(service, max_results: int, query: str = None, label_ids=("INBOX",), page_token: str = None):
+    """One messages.list page: (message IDs newest first, next page token)."""
+    response = await execute_async(service.users().messages().list(
+        userId="me",
+        labelIds=list(label_ids) if label_ids else None,
+        q=query or None,
+        maxResults=max_results,
+        pageToken=page_token,
+        fields=LIST_FIELDS
+    ))
+    return [msg['id'] for msg in response.get('messages', [])], response.get('nextPageToken')
+
+def label_query_term(label_name: str) -> str:
+    """Gmail search term matching a label name (spaces and slashes become hyphens)."""
+    return "label:" + label_name.replace(" ", "-").replace("/", "-")
+
+def exclude_processed(query: str) -> str:
+    """Add the processed-label exclusion to a Gmail search query."""
+    if not GMAIL_PROCESSED_LABEL:
+        return query
+    return f"{query} -{label_query_term(GMAIL_PROCESSED_LABEL)}".strip()
+
+async def resolve_gmail_query(user_id: int) -> str:
+    """The user's Gmail search query, or GMAIL_DEFAULT_QUERY when they have none."""
+    try:
+        query = await get_mongo_db().get_gmail_query(user_id)
+    except Exception as e:
+        logger.error(f"Failed to load Gmail query for user {user_id}: {e}")
+        query = None
+    return query or GMAIL_DEFAULT_QUERY
+
+async def filter_ids_by_query(service, message_ids: list, query: str) -> list:
+    """The subset of message_ids (in order) that matches a Gmail search query.
+
+    history.list cannot filter by query, so Gmail evaluates it: the new IDs are intersected
+    with one messages.list page (IDs only) for the query. New mail is the newest in the
+    mailbox, so any of it that matches is on that page; a message re-added to INBOX with
+    an old date behind more than 500 newer matches is not.
+    """
+    if not query or not message_ids:
+        return message_ids
+    matching, _ = await list_inbox_page(service, 500, query=query)
+    matching = set(matching)
+    return [message_id for message_id in message_ids if message_id in matching]
+
+async def list_inbox_message_ids(service, max_results: int, query: str = None) -> list:
+    """IDs of the latest INBOX messages matching `query`, newest first."""
+    message_ids, _ = await list_inbox_page(service, max_results, query=query)
+    return message_ids
+
+async def list_new_message_ids(service, user_id: int, max_results: int, skip_processed: bool = True, query: str = None) -> list:
+    """IDs of INBOX messages added since the user's last sync that match `query`, newest first,
+    at most max_results.
+
+    Reads users.history.list from the stored historyId checkpoint. Without a checkpoint,
+    or when Gmail no longer has history that old (404), falls back to listing the latest
+    max_results messages.
+
+    The checkpoint is not advanced here: the historyId reached is staged, and the caller
+    commits it with MongoManager.commit_gmail_history_id once the messages are handled.
+    When more than max_results unhandled messages are new, nothing is staged, so the next
+    run reads the same history and picks up the rest after the ledger drops these.
+    """
+    mongo_db = get_mongo_db()
+    start_history_id = await mongo_db.get_gmail_history_id(user_id)
+    
+    if start_history_id:
+        try:
+            message_ids = []
+            page_token = None
+            while True:
+                response = await execute_async(service.users().history().list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    labelId="INBOX",
+                    pageToken=page_token,
+                    fields=HISTORY_FIELDS
+                ))
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message = added.get('message', {})
+                        if 'INBOX' in message.get('labelIds', ['INBOX']):
+                            message_ids.append(message['id'])
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+            
+            # History is oldest first; newest first, without duplicates
+            message_ids = list(dict.fromkeys(reversed(message_ids)))
+            if skip_processed:
+                message_ids = await mongo_db.filter_unprocessed_messages(user_id, message_ids)
+            # Before the cut, so non-matching messages never take a matching one's place
+            message_ids = await filter_ids_by_query(service, message_ids, query)
+            history_id = response.get('historyId', start_history_id)
+            if not message_ids:
+                # Nothing to handle, so nothing can be lost by moving on
+                await mongo_db.set_gmail_history_id(user_id, history_id)
+            elif len(message_ids) <= max_results:
+                await mongo_db.stage_gmail_history_id(user_id, history_id)
+            else:
+                logger.info(f"{len(message_ids)} new messages for user {user_id}; handling {max_results} this run")
+            logger.info(f"Incremental sync found {len(message_ids)} new messages for user {user_id}")
+            return message_ids[:max_results]
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            logger.warning(f"Gmail history checkpoint expired for user {user_id}; falling back to a full list")
+    
+    # Take the checkpoint before listing so messages arriving meanwhile are picked up next run
+    profile = await execute_async(service.users().getProfile(userId="me", fields="historyId"))
+    message_ids = await list_inbox_message_ids(service, max_results, query=query)
+    if skip_processed:
+        message_ids = await mongo_db.filter_unprocessed_messages(user_id, message_ids)
+    if message_ids:
+        await mongo_db.stage_gmail_history_id(user_id, profile['historyId'])
+    else:
+        await mongo_db.set_gmail_history_id(user_id, profile['historyId'])
+    return message_ids
+
+async def has_new_messages(service, user_id: int, max_pages: int = 5):
+    """Whether INBOX gained messages since the sync checkpoint, without advancing it.
+
+    Returns None when that cannot be told cheaply (no checkpoint yet, or it expired).
+    """
+    start_history_id = await get_mongo_db().get_gmail_history_id(user_id)
+    if not start_history_id:
+        return None
+    try:
+        page_token = None
+        for _ in range(max_pages):
+            response = await execute_async(service.users().history().list(
+                userId="me",
+                startHistoryId=start_history_id,
+                historyTypes=["messageAdded"],
+                labelId="INBOX",
+                pageToken=page_token,
+                fields=HISTORY_FIELDS
+            ))
+            if any(record.get('messagesAdded') for record in response.get('history', [])):
+                return True
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return False
+        return None
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        return None
+
+def parse_message(user_id: int, message: dict, metadata_only: bool) -> dict:
+    """Email dict (id, subject, from, date, snippet, body) for a messages.get response."""
+    headers = message.get('payload', {}).get('headers', [])
+    email_data = {
+        "id": message.get('id'),
+        "thread_id": message.get('threadId'),
+        "subject": "No Subject",
+        "body": "",
+        "from": "Unknown Sender",
+        "date": "Unknown Date"
+    }
+    
+    for header in headers:
+        name = header.get('name', '').lower()
+        value = header.get('value', '')
+        if name == 'subject':
+            email_data['subject'] = value
+        elif name == 'from':
+            email_data['from'] = value
+        elif name == 'date':
+            email_data['date'] = value
+        elif name == 'message-id':
+            email_data['message_id_header'] = value
+
+    if email_data['id']:
+        reply_header_cache.put(user_id, email_data['id'], {
+            "thread_id": email_data['thread_id'],
+            "in_reply_to": email_data.get('message_id_header')
+        })
+    email_data['snippet'] = unescape(message.get('snippet', ''))
+    if metadata_only:
+        # Scoring works from the snippet; the full body is loaded only if a reply is needed
+        email_data['body'] = email_data['snippet']
+    else:
+        # Extract and clean email body using provided functions
+        email_data['body'] = get_email_body(message.get('payload', {}))
+        body_cache.put(user_id, email_data['id'], email_data['body'])
+    return email_data
+
+async def fetch_emails_by_id(service, user_id: int, message_ids: list, metadata_only: bool, skip_processed: bool = True) -> list:
+    """Download and parse the given messages, in order, skipping ledger hits and failed gets."""
+    if skip_processed:
+        # Messages already in the ledger were scored on an earlier run
+        message_ids = await get_mongo_db().filter_unprocessed_messages(user_id, message_ids)
+    if not message_ids:
+        return []
+    
+    # One batch HTTP call per GMAIL_BATCH_SIZE messages instead of a get per message
+    fetched = await run_blocking(
+        batch_get_messages,
+        service,
+        message_ids,
+        timeout=None,  # Each batch call is bounded by the transport timeout; retries add backoff
+        format="metadata" if metadata_only else "full",
+        metadataHeaders=["Subject", "From", "Date", "Message-ID"],
+        fields=METADATA_FIELDS if metadata_only else FULL_FIELDS
+    )
+    
+    emails = []
+    for msg_id, message in zip(message_ids, fetched):
+        if message is None:
+            logger.warning(f"Skipping message {msg_id} for user {user_id}: could not be fetched")
+            continue
+        emails.append(parse_message(user_id, message, metadata_only))
+    return emails
+
+def summarize_thread(user_id: int, thread: dict):
+    """One email dict for a whole thread, or None for an empty thread.
+
+    The latest inbound message represents the thread; its body has quoted history removed,
+    so the scoring prompt carries only what is new. The whole conversation, each message
+    stripped the same way, is kept in thread_cache as the reply context.
+    """
+    messages = thread.get('messages') or []
+    if not messages:
+        return None
+    parsed = [parse_message(user_id, message, metadata_only=False) for message in messages]
+    inbound = [
+        email_data for email_data, message in zip(parsed, messages)
+        if 'SENT' not in message.get('labelIds', [])
+    ]
+    latest = dict((inbound or parsed)[-1])
+    
+    transcript = "\n\n".join(
+        f"From: {email_data['from']} ({email_data['date']})\n{strip_quoted_history(email_data['body'])}"
+        for email_data in parsed
+    )
+    if len(transcript) > EMAIL_BODY_MAX_CHARS:
+        transcript = transcript[-EMAIL_BODY_MAX_CHARS:]  # Keep the newest part of long threads
+    
+    latest['body'] = strip_quoted_history(latest['body'])
+    latest['thread_id'] = thread.get('id')
+    latest['message_ids'] = [email_data['id'] for email_data in parsed]
+    latest['message_count'] = len(parsed)
+    thread_cache.put(user_id, latest['id'], {
+        "thread_id": thread.get('id'),
+        "message_ids": latest['message_ids'],
+        "message_id_header": latest.get('message_id_header'),
+        "transcript": transcript
+    })
+    return latest
+
+async def group_into_threads(service, user_id: int, emails: list) -> list:
+    """Collapse per-message emails into one email per thread, fetching each thread once."""
+    thread_ids = list(dict.fromkeys(email_data['thread_id'] for email_data in emails if email_data.get('thread_id')))
+    if not thread_ids:
+        return emails
+    threads = await run_blocking(batch_get_threads, service, thread_ids, timeout=None, format="full", fields=THREAD_FIELDS)
+    by_thread = dict(zip(thread_ids, threads))
+    
+    grouped, seen = [], set()
+    for email_data in emails:
+        thread_id = email_data.get('thread_id')
+        if thread_id in seen:
+            continue
+        thread = by_thread.get(thread_id)
+        summary = summarize_thread(user_id, thread) if thread else None
+        if summary is None:
+            grouped.append(email_data)  # Thread could not be fetched; fall back to the message
+        else:
+            seen.add(thread_id)
+            grouped.append(summary)
+    logger.info(f"Grouped {len(emails)} messages into {len(grouped)} threads for user {user_id}")
+    return grouped
+
+def thread_for_message(user_id: int, message_id: str):
+    """Thread summary for a message that represented a thread in thread mode, else None."""
+    return thread_cache.get(user_id, message_id) if message_id else None
+
+async def iter_inbox(
+    user_id: int,
+    query: str = None,
+    label_ids=("INBOX",),
+    limit: int = None,
+    page_size: int = GMAIL_PAGE_SIZE,
+    max_pages: int = None,
+    fetch_mode: str = None,
+    skip_processed: bool = True,
+    prefetch: int = GMAIL_PREFETCH_PAGES
+):
+    """
+    Stream parsed emails from the user's mailbox, newest first.
+    
+    Follows nextPageToken across messages.list pages filtered by `query` (Gmail search
+    syntax) and `label_ids`. A background task downloads up to `prefetch` pages ahead of
+    the consumer; it is cancelled when the consumer stops iterating.
+    
+    Args:
+        user_id: The ID of the user
+        query: Gmail search query, e.g. "newer_than:7d -category:promotions"
+        label_ids: Labels every message must carry
+        limit: Stop after this many emails
+        page_size: Messages per messages.list page (Gmail allows up to 500)
+        max_pages: Stop after this many pages
+        fetch_mode: "metadata" or "full" (defaults to GMAIL_FETCH_MODE)
+        skip_processed: Leave out messages recorded in the processed-message ledger
+    """
+    metadata_only = (fetch_mode or GMAIL_FETCH_MODE) == "metadata"
+    service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+    if not service:
+        logger.error(f"Failed to create Gmail service for user {user_id}")
+        return
+    
+    done = object()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, prefetch))
+    stopped = False
+    
+    async def produce():
+        try:
+            page_token = None
+            pages = 0
+            while not stopped:
+                message_ids, page_token = await list_inbox_page(
+                    service, page_size, query=query, label_ids=label_ids, page_token=page_token
+                )
+                emails = await fetch_emails_by_id(service, user_id, message_ids, metadata_only, skip_processed)
+                pages += 1
+                if stopped:
+                    return
+                await queue.put(emails)
+                if not page_token or (max_pages and pages >= max_pages):
+                    break
+            await queue.put(done)
+        except Exception as e:
+            await queue.put(e)
+    
+    producer = asyncio.create_task(produce())
+    yielded = 0
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            for email_data in item:
+                yield email_data
+                yielded += 1
+                if limit and yielded >= limit:
+                    return
+    finally:
+        # cancel() alone can be lost when it races a finishing wait_for, so the producer also
+        # checks `stopped` and the queue is drained to release a pending put
+        stopped = True
+        producer.cancel()
+        while not producer.done():
+            while not queue.empty():
+                queue.get_nowait()
+            await asyncio.wait([producer], timeout=0.1)
+        if not producer.cancelled() and producer.exception():
+            logger.debug(f"Inbox prefetch for user {user_id} ended with: {producer.exception()}")
+
+async def iter_chunks(emails, size: int):
+    """Group an async iterator of emails into lists of at most `size`."""
+    chunk = []
+    async for email_data in emails:
+        chunk.append(email_data)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def iter_inbox_chunks(user_id: int, chunk_size: int, limit: int = None, query: str = None, group_by: str = None):
+    """Unprocessed INBOX mail in lists of at most `chunk_size`, streamed through iter_inbox.
+
+    Uses the user's query (see resolve_gmail_query) minus the processed label. Each chunk
+    is ready for scoring while later pages are still downloading; in thread mode it is
+    collapsed to one email per thread.
+    """
+    if query is None:
+        query = await resolve_gmail_query(user_id)
+    emails = iter_inbox(user_id, query=exclude_processed(query), limit=limit)
+    async for chunk in iter_chunks(emails, chunk_size):
+        if (group_by or GMAIL_GROUP_BY) == "thread":
+            service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+            chunk = await group_into_threads(service, user_id, chunk)
+        yield chunk
+
+async def fetch_recent_emails(
+    user_id: int,
+    max_results: int = 5,
+    incremental: bool = None,
+    fetch_mode: str = None,
+    skip_processed: bool = True,
+    query: str = None,
+    group_by: str = None
+) -> list:
     """
     Fetch recent emails from the user's Gmail inbox asynchronously.
     
     Args:
         user_id: The ID of the user
         max_results: Maximum number of emails to fetch
+        incremental: Only fetch messages added since the last sync (defaults to GMAIL_SYNC_MODE)
+        fetch_mode: "metadata" returns the snippet as body (use get_message_body for the full
+            text); "full" downloads and cleans every body (defaults to GMAIL_FETCH_MODE)
+        skip_processed: Leave out messages recorded in the processed-message ledger
+        query: Gmail search query evaluated by Gmail (defaults to the user's stored query,
+            then GMAIL_DEFAULT_QUERY; "" disables filtering)
+        group_by: "thread" returns one email per thread (see summarize_thread); defaults to GMAIL_GROUP_BY
     
     Returns:
         List of email dictionaries
     """
+    if incremental is None:
+        incremental = GMAIL_SYNC_MODE == "incremental"
+    metadata_only = (fetch_mode or GMAIL_FETCH_MODE) == "metadata"
     try:
-        service = await get_gmail_service(user_id, scopes=SCOPES_READ)
-        if not service:
-            logger.error(f"Failed to create Gmail service for user {user_id}")
-            return []
-            
-        response = service.users().messages().list(
-            userId="me",
-            labelIds=["INBOX"],
-            maxResults=max_results
-        ).execute()
-        
-        messages = response.get('messages', [])
-        emails = []
-        
-        for msg in messages:
-            msg_id = msg['id']
-            message = service.users().messages().get(
-                userId="me",
-                id=msg_id,
-                format="full" , # Changed to 'full' to get complete payload
-                # format="metadata",
-                metadataHeaders=["subject", "from", "date"]
-            ).execute()
-            
-            headers = message.get('payload', {}).get('headers', [])
-            email_data = {
-                "id": msg_id,
-                "subject": "No Subject",
-                "body": "",
-                "from": "Unknown Sender",
-                "date": "Unknown Date"
-            }
+        if query is None:
+            query = await resolve_gmail_query(user_id)
+        if incremental:
+            service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+            if not service:
+                logger.error(f"Failed to create Gmail service for user {user_id}")
+                return []
+            # The ledger and the query were applied before the history delta was cut to max_results
+            message_ids = await list_new_message_ids(service, user_id, max_results, skip_processed, query=query)
+            emails = await fetch_emails_by_id(service, user_id, message_ids, metadata_only, skip_processed=False)
+        else:
+            # The latest page only, for the crew's fetch tool; iter_inbox_chunks walks the whole mailbox
+            emails = [
+                email_data async for email_data in iter_inbox(
+                    user_id,
+                    query=exclude_processed(query),
+                    limit=max_results,
+                    page_size=max_results,
+                    max_pages=1,
+                    fetch_mode=fetch_mode,
+                    skip_processed=skip_processed
+                )
+            ]
             
-            for header in headers:
-                name = header.get('name', '').lower()
-                value = header.get('value', '')
-                if name == 'subject':
-                    email_data['subject'] = value
-                elif name == 'from':
-                    email_data['from'] = value
-                elif name == 'date':
-                    email_data['date'] = value
-
-             # Extract and clean email body using provided functions
-            email_data['body'] = get_email_body(message.get('payload', {}))
-                                
-            emails.append(email_data)
+        if emails and (group_by or GMAIL_GROUP_BY) == "thread":
+            service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+            emails = await group_into_threads(service, user_id, emails)
             
         logger.info(f"Successfully fetched {len(emails)} emails for user {user_id}")
         return emails
@@ -201,6 +552,26 @@ async def fetch_recent_emails(user_id: int, max_results: int = 5) -> list:
         logger.error(f"Error fetching emails for user {user_id}: {e}", exc_info=True)
         return []
         
+async def get_message_body(user_id: int, message_id: str) -> str:
+    """Full cleaned body of one message, fetched on first use and cached. Empty string on failure."""
+    body = body_cache.get(user_id, message_id)
+    if body is not None:
+        return body
+    try:
+        service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+        if not service:
+            logger.error(f"Failed to create Gmail service for user {user_id}")
+            return ""
+        message = await execute_async(service.users().messages().get(
+            userId="me", id=message_id, format="full", fields="payload"
+        ))
+        body = get_email_body(message.get('payload', {}))
+        body_cache.put(user_id, message_id, body)
+        return body
+    except Exception as e:
+        logger.error(f"Error fetching body of message {message_id} for user {user_id}: {e}", exc_info=True)
+        return ""
+
 def decode_header(header_value):
     """Decode email header value, handling non-ASCII characters."""
     decoded_parts = []
@@ -221,122 +592,188 @@ def decode_header(header_value):
     return "".join(decoded_parts)
 
 
-# Add these imports at the top
-from html import unescape
-from html2text import HTML2Text
+async def ensure_label(service, user_id: int, name: str) -> str:
+    """ID of the user's Gmail label `name`, creating it on first use. Cached per user."""
+    with _label_ids_lock:
+        label_id = _label_ids.get((user_id, name))
+    if label_id:
+        return label_id
 
+    response = await execute_async(service.users().labels().list(userId="me", fields="labels(id,name)"))
+    label_id = next((label['id'] for label in response.get('labels', []) if label['name'] == name), None)
+    if not label_id:
+        try:
+            created = await execute_async(service.users().labels().create(userId="me", body={
+                "name": name,
+                "labelListVisibility": "labelShow",
+                "messageListVisibility": "show"
+            }, fields="id"))
+            label_id = created['id']
+            logger.info(f"Created Gmail label {name} for user {user_id}")
+        except HttpError as e:
+            if e.resp.status != 409:
+                raise
+            # Created concurrently by another run
+            response = await execute_async(service.users().labels().list(userId="me", fields="labels(id,name)"))
+            label_id = next(label['id'] for label in response.get('labels', []) if label['name'] == name)
 
-def get_email_body(payload) -> str:
-    """Extract and convert full email body with HTML handling"""
-    # Handle single-part emails
-    if 'parts' not in payload:
-        return extract_part_body(payload)
-    
-    # Process multi-part emails
-    text_converter = HTML2Text()
-    text_converter.ignore_links = False
-    text_converter.ignore_images = True
-    text_converter.ignore_tables = True
-    text_converter.ignore_emphasis = False
-    text_converter.body_width = 0  # No line wrapping
-    text_converter.single_line_break = True
-    
-    body_parts = []
-    
-    # Process all text parts
-    for part in payload['parts']:
-        mime_type = part.get('mimeType', '')
-        body_data = part.get('body', {}).get('data', '')
+    with _label_ids_lock:
+        _label_ids[(user_id, name)] = label_id
+    return label_id
+
+def forget_labels(user_id: int) -> None:
+    """Drop the user's cached label IDs so the next ensure_label looks them up again."""
+    with _label_ids_lock:
+        for key in [key for key in _label_ids if key[0] == user_id]:
+            del _label_ids[key]
+
+async def label_messages(user_id: int, processed_ids: list, urgent_ids: list = (), refresh_stale: bool = True) -> bool:
+    """Mark handled messages in the mailbox: GMAIL_PROCESSED_LABEL on all, GMAIL_URGENT_LABEL on urgent ones.
+
+    One messages.batchModify call per label set (up to 1000 messages each). Needs the
+    gmail.modify scope; returns False and logs if labelling was not possible. If Gmail
+    rejects a cached label ID (400/404, the label was deleted), the user's label IDs are
+    dropped and labelling is tried once more with fresh ones.
+    """
+    urgent = list(dict.fromkeys(urgent_ids)) if GMAIL_URGENT_LABEL else []
+    urgent_set = set(urgent)
+    processed = [message_id for message_id in dict.fromkeys(processed_ids) if message_id not in urgent_set]
+    if not GMAIL_PROCESSED_LABEL:
+        processed = []
+    if not processed and not urgent:
+        return True
+    try:
+        service = await get_gmail_service(user_id, scopes=SCOPES_MODIFY)
+        if not service:
+            logger.error(f"Failed to create Gmail service for user {user_id}")
+            return False
         
-        if not body_data:
-            continue
-            
-        try:
-            decoded = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-            
-            if mime_type == 'text/plain':
-                body_parts.append(decoded)
-            elif mime_type == 'text/html':
-                # Convert HTML to clean text
-                converted = text_converter.handle(decoded)
-                body_parts.append(converted)
-        except Exception as e:
-            logger.error(f"Error processing email part: {e}")
-    
-    # Combine all parts
-    return clean_email_body("\n\n".join(body_parts))
+        label_sets = []
+        if processed:
+            label_sets.append((processed, [await ensure_label(service, user_id, GMAIL_PROCESSED_LABEL)]))
+        if urgent:
+            label_ids = [await ensure_label(service, user_id, GMAIL_URGENT_LABEL)]
+            if GMAIL_PROCESSED_LABEL:
+                label_ids.append(await ensure_label(service, user_id, GMAIL_PROCESSED_LABEL))
+            label_sets.append((urgent, label_ids))
+        
+        for message_ids, label_ids in label_sets:
+            for start in range(0, len(message_ids), 1000):
+                await execute_async(service.users().messages().batchModify(userId="me", body={
+                    "ids": message_ids[start:start + 1000],
+                    "addLabelIds": label_ids
+                }))
+        logger.info(f"Labelled {len(processed) + len(urgent)} handled messages for user {user_id}")
+        return True
+    except HttpError as e:
+        if e.resp.status == 403:
+            logger.warning(f"User {user_id} has not granted gmail.modify; handled messages were not labelled")
+        elif e.resp.status in (400, 404):
+            forget_labels(user_id)
+            if refresh_stale:
+                logger.warning(f"Gmail rejected cached label IDs for user {user_id}; looking them up again: {e}")
+                return await label_messages(user_id, processed_ids, urgent_ids, refresh_stale=False)
+            logger.error(f"Gmail rejected the labels for user {user_id}: {e}")
+        else:
+            logger.error(f"Gmail API error labelling messages for user {user_id}: {e}", exc_info=True)
+        return False
+    except Exception as e:
+        logger.error(f"Error labelling messages for user {user_id}: {e}", exc_info=True)
+        return False
 
-def extract_part_body(part) -> str:
-    """Extract body from single part"""
-    body_data = part.get('body', {}).get('data', '')
-    if not body_data:
-        return ""
-    
+async def get_reply_context(user_id: int, message_id: str) -> str:
+    """What a reply to `message_id` should be based on: its thread's transcript in thread mode, else its body."""
+    thread = thread_for_message(user_id, message_id)
+    if thread:
+        return thread['transcript']
+    return await get_message_body(user_id, message_id)
+
+async def get_reply_headers(user_id: int, message_id: str) -> dict:
+    """thread_id and in_reply_to for a reply to `message_id`, as taken by build_reply_message.
+
+    Served from the thread summary or the headers seen when the message was fetched; after
+    an eviction or restart they are read back from Gmail. Empty dict if that fails.
+    """
+    thread = thread_for_message(user_id, message_id)
+    if thread:
+        return {"thread_id": thread['thread_id'], "in_reply_to": thread.get('message_id_header')}
+    headers = reply_header_cache.get(user_id, message_id)
+    if headers is not None:
+        return headers
     try:
-        content = base64.urlsafe_b64decode(body_data).decode('utf-8', errors='replace')
-        return clean_email_body(content)
+        service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+        if not service:
+            logger.error(f"Failed to create Gmail service for user {user_id}")
+            return {}
+        message = await execute_async(service.users().messages().get(
+            userId="me", id=message_id, format="metadata", metadataHeaders=["Message-ID"], fields="threadId,payload/headers"
+        ))
+        headers = {
+            "thread_id": message.get('threadId'),
+            "in_reply_to": next((
+                header.get('value') for header in message.get('payload', {}).get('headers', [])
+                if header.get('name', '').lower() == 'message-id'
+            ), None)
+        }
+        reply_header_cache.put(user_id, message_id, headers)
+        return headers
     except Exception as e:
-        logger.error(f"Error decoding email part: {e}")
-        return ""
+        logger.error(f"Error fetching reply headers of message {message_id} for user {user_id}: {e}", exc_info=True)
+        return {}
 
-def clean_email_body(body: str) -> str:
-    """Clean email body while preserving essential content"""
-    if not body:
-        return ""
-    
-    # Remove HTML remnants
-    body = re.sub(r'<[^>]+>', '', body)
-    
-    # Preserve important separators
-    body = re.sub(r'\n-{4,}\s*', '\n---\n', body)
-    
-    # Remove tracking links
-    body = re.sub(r'https?://[^\s]*(tracking|utm_)[^\s]*', '', body, flags=re.IGNORECASE)
-    
-    # Remove common email signatures
-    signature_patterns = [
-        r'^\s*--\s*$.*',
-        r'\nSent from my .+\n',
-        r'\nBest regards,\n.*',
-        r'\nSincerely,\n.*',
-        r'\nCheers,\n.*',
-        r'\n\d{3}-\d{3}-\d{4}',
-    ]
+def build_reply_message(
+    recipient_email: str,
+    subject: str,
+    reply_body: str,
+    thread_id: str = None,
+    in_reply_to: str = None
+) -> dict:
+    """messages.send body for a plain-text reply. Raises ValueError for an unusable recipient.
+
+    With thread_id (and the Message-ID header being answered as in_reply_to) Gmail files the
+    reply into the existing conversation for both sides.
+    """
+    recipient_email = (recipient_email or "").strip()
+    if not recipient_email or '@' not in recipient_email:
+        raise ValueError("Invalid recipient email address")
     
-    for pattern in signature_patterns:
-        body = re.sub(pattern, '', body, flags=re.IGNORECASE | re.MULTILINE)
+    message = MIMEText(reply_body)
+    message['to'] = recipient_email
+    message['subject'] = f"Re: {subject}"
+    if in_reply_to:
+        message['In-Reply-To'] = in_reply_to
+        message['References'] = in_reply_to
     
-    # Normalize whitespace
-    body = re.sub(r'[ \t]+', ' ', body)
-    body = re.sub(r'\n{3,}', '\n\n', body)
-    return body.strip()
+    raw_message = {
+        'raw': base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+    }
+    if thread_id:
+        raw_message['threadId'] = thread_id
+    return raw_message
 
-async def send_reply(user_id: int, recipient_email: str, subject: str, reply_body: str) -> bool:
-    """Send a reply email synchronously"""
+async def send_reply(
+    user_id: int,
+    recipient_email: str,
+    subject: str,
+    reply_body: str,
+    thread_id: str = None,
+    in_reply_to: str = None
+) -> bool:
+    """Send a reply email without blocking the event loop"""
     try:
         service = await get_gmail_service(user_id, scopes=SCOPES_SEND)
         if not service:
             logger.error(f"Failed to create Gmail service for user {user_id}")
             return False
         
-        recipient_email = recipient_email.strip()
-        if not recipient_email or '@' not in recipient_email:
-            raise ValueError("Invalid recipient email address")
+        raw_message = build_reply_message(recipient_email, subject, reply_body, thread_id, in_reply_to)
         
-        message = MIMEText(reply_body)
-        message['to'] = recipient_email
-        message['subject'] = f"Re: {subject}"
-        
-        raw_message = {
-            'raw': base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        }
-        
-        service.users().messages().send(
+        await execute_async(service.users().messages().send(
             userId='me',
             body=raw_message
-        ).execute()
+        ))
         
-        logger.info(f"Reply sent to {recipient_email} for user {user_id}")
+        logger.info(f"Reply sent to {recipient_email.strip()} for user {user_id}")
         return True
     
     except HttpError as error:
@@ -344,4 +781,4 @@ async def send_reply(user_id: int, recipient_email: str, subject: str, reply_bod
         return False
     except Exception as e:
         logger.error(f"Error sending email for user {user_id}: {e}", exc_info=True)
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,185 @@
+"""Gmail push notifications (users.watch via Cloud Pub/Sub).
+
+Pub/Sub delivers a notification to POST /gmail/push whenever a watched mailbox changes.
+Notifications for a user are debounced into one scheduled run of the incremental
+fetch-and-score job, so work follows mail volume instead of a fixed cron.
+
+A local stand-in for Pub/Sub posts the same envelope shape to a running API:
+
+    python -m src.services.gmail_push --email someone@example.com --history-id 12345 \\
+        --url http://localhost:8001/gmail/push --token $GMAIL_PUSH_TOKEN
+"""
+import argparse
+import base64
+import hmac
+import json
+import logging
+import os
+import uuid
+import requests
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+from apscheduler.jobstores.base import ConflictingIdError
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from src.db.db import get_mongo_db
+from src.services.gmail_d import SCOPES_READ, get_gmail_service
+from src.services.google_exec import execute_async
+from src.services.scheduler_service import scheduler_manager
+
+logger = logging.getLogger(__name__)
+
+# Pub/Sub topic Gmail publishes to, e.g. projects/my-project/topics/gmail-push
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC", "")
+# Shared secret the push subscription appends to the endpoint URL (?token=...)
+GMAIL_PUSH_TOKEN = os.getenv("GMAIL_PUSH_TOKEN", "")
+# Notifications for a user within this window are coalesced into one ingestion run
+GMAIL_PUSH_DEBOUNCE = float(os.getenv("GMAIL_PUSH_DEBOUNCE", "30"))
+# Gmail expires watches after 7 days; renew those expiring within this margin
+GMAIL_WATCH_RENEW_MARGIN_HOURS = float(os.getenv("GMAIL_WATCH_RENEW_MARGIN_HOURS", "48"))
+GMAIL_WATCH_RENEW_INTERVAL_HOURS = float(os.getenv("GMAIL_WATCH_RENEW_INTERVAL_HOURS", "12"))
+
+# Scheduler references by name so jobs survive in the MongoDB job store
+INGEST_JOB = "src.services.jobs:process_gmail_push"
+RENEW_JOB = "src.services.gmail_push:renew_watches"
+
+def is_push_schedule(schedule: Optional[Dict[str, Any]]) -> bool:
+    """Whether a Gmail schedule preference asks for push notifications instead of a cron poll."""
+    return (schedule or {}).get("frequency", "").lower() == "push"
+
+def verify_token(token: Optional[str]) -> bool:
+    return bool(GMAIL_PUSH_TOKEN) and hmac.compare_digest(token or "", GMAIL_PUSH_TOKEN)
+
+def decode_envelope(envelope: Dict[str, Any]) -> Tuple[str, str]:
+    """(emailAddress, historyId) from a Pub/Sub push envelope. Raises ValueError if malformed."""
+    try:
+        data = envelope["message"]["data"]
+        payload = json.loads(base64.b64decode(data + "=" * (-len(data) % 4)))
+        return payload["emailAddress"], str(payload["historyId"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed Gmail push envelope: {e}")
+
+def build_envelope(email_address: str, history_id: str, subscription: str = "projects/local/subscriptions/gmail-push") -> Dict[str, Any]:
+    """Pub/Sub push envelope as Gmail would publish it."""
+    data = json.dumps({"emailAddress": email_address, "historyId": int(history_id)})
+    return {
+        "message": {
+            "data": base64.b64encode(data.encode("utf-8")).decode("ascii"),
+            "messageId": uuid.uuid4().hex,
+            "publishTime": datetime.now(timezone.utc).isoformat()
+        },
+        "subscription": subscription
+    }
+
+async def start_watch(user_id: int) -> datetime:
+    """Register (or renew) the users.watch for a user's INBOX. Returns the expiry."""
+    if not GMAIL_PUSH_TOPIC:
+        raise ValueError("GMAIL_PUSH_TOPIC is not configured")
+    service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+    if not service:
+        raise RuntimeError(f"Failed to create Gmail service for user {user_id}")
+
+    profile = await execute_async(service.users().getProfile(userId="me", fields="emailAddress,historyId"))
+    response = await execute_async(service.users().watch(userId="me", body={
+        "topicName": GMAIL_PUSH_TOPIC,
+        "labelIds": ["INBOX"],
+        "labelFilterBehavior": "include"
+    }))
+    expires_at = datetime.fromtimestamp(int(response["expiration"]) / 1000, tz=timezone.utc)
+
+    mongo_db = get_mongo_db()
+    await mongo_db.set_gmail_watch(user_id, profile["emailAddress"], expires_at)
+    if not await mongo_db.get_gmail_history_id(user_id):
+        # Start incremental sync from the watch so the first notification has a baseline
+        await mongo_db.set_gmail_history_id(user_id, response.get("historyId", profile["historyId"]))
+    logger.info(f"Gmail watch active for user {user_id} until {expires_at}")
+    return expires_at
+
+async def stop_watch(user_id: int) -> None:
+    """Stop the user's users.watch and forget it, so it is no longer renewed."""
+    try:
+        service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+        if service:
+            await execute_async(service.users().stop(userId="me"))
+    except Exception as e:
+        logger.error(f"Failed to stop Gmail watch for user {user_id}: {e}")
+    await get_mongo_db().clear_gmail_watch(user_id)
+
+async def renew_watches() -> int:
+    """Renew every watch that expires within the renewal margin. Returns the number renewed."""
+    before = datetime.now(timezone.utc) + timedelta(hours=GMAIL_WATCH_RENEW_MARGIN_HOURS)
+    renewed = 0
+    for user_id in await get_mongo_db().get_expiring_gmail_watches(before):
+        try:
+            await start_watch(user_id)
+            renewed += 1
+        except Exception as e:
+            logger.error(f"Failed to renew Gmail watch for user {user_id}: {e}", exc_info=True)
+    if renewed:
+        logger.info(f"Renewed {renewed} Gmail watches")
+    return renewed
+
+def schedule_watch_renewal() -> None:
+    """Add the periodic watch renewal job to the running scheduler."""
+    scheduler_manager.scheduler.add_job(
+        RENEW_JOB,
+        trigger=IntervalTrigger(hours=GMAIL_WATCH_RENEW_INTERVAL_HOURS),
+        id="gmail_watch_renewal",
+        replace_existing=True,
+        next_run_time=datetime.now(timezone.utc) + timedelta(minutes=1)
+    )
+
+def schedule_ingestion(user_id: int) -> bool:
+    """Queue one ingestion run GMAIL_PUSH_DEBOUNCE seconds out, unless one is already pending."""
+    job_id = f"gmail_push_{user_id}"
+    scheduler = scheduler_manager.scheduler
+    if scheduler.get_job(job_id):
+        return False
+    try:
+        scheduler.add_job(
+            INGEST_JOB,
+            trigger=DateTrigger(run_date=datetime.now(timezone.utc) + timedelta(seconds=GMAIL_PUSH_DEBOUNCE)),
+            id=job_id,
+            args=(user_id,),
+            misfire_grace_time=None
+        )
+    except ConflictingIdError:
+        return False  # Another notification scheduled it first
+    return True
+
+async def handle_notification(email_address: str, history_id: str) -> str:
+    """Route one push notification. Returns what was done, for the endpoint response and logs."""
+    mongo_db = get_mongo_db()
+    user_id = await mongo_db.get_gmail_watch_user(email_address)
+    if user_id is None:
+        logger.warning(f"Gmail push for unwatched mailbox {email_address}")
+        return "ignored"
+
+    checkpoint = await mongo_db.get_gmail_history_id(user_id)
+    if checkpoint and int(history_id) <= int(checkpoint):
+        # Already synced past this change
+        return "up_to_date"
+
+    if schedule_ingestion(user_id):
+        logger.info(f"Gmail push for user {user_id} (historyId {history_id}); ingestion in {GMAIL_PUSH_DEBOUNCE:.0f}s")
+        return "scheduled"
+    return "debounced"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Post a Gmail push notification to a local API, as Pub/Sub would.")
+    parser.add_argument("--email", required=True, help="Watched mailbox address")
+    parser.add_argument("--history-id", required=True)
+    parser.add_argument("--url", default="http://localhost:8001/gmail/push")
+    parser.add_argument("--token", default=GMAIL_PUSH_TOKEN)
+    args = parser.parse_args()
+
+    response = requests.post(
+        args.url,
+        params={"token": args.token},
+        json=build_envelope(args.email, args.history_id),
+        timeout=10
+    )
+    print(response.status_code, response.text)
+
+if __name__ == "__main__":
+    main()
@@ -6,70 +6,28 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from bs4 import BeautifulSoup
+from src.services.email_body import extract_body
+from src.services.gmail_batch import batch_get_messages
 
 
 # Define the required Gmail API scopes
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 SCOPES_SEND = ["https://www.googleapis.com/auth/gmail.send"]
-
-def extract_parts(parts):
-    plain_text = None
-    html_text = None
-
-    for part in parts:
-        mime_type = part.get("mimeType", "")
-        body_data = part.get("body", {}).get("data")
-
-        if "parts" in part:
-            sub_plain, sub_html = extract_parts(part["parts"])
-            if sub_plain:
-                plain_text = sub_plain
-            if sub_html:
-                html_text = sub_html
-
-        if body_data:
-            try:
-                decoded = base64.urlsafe_b64decode(body_data).decode("utf-8")
-                if mime_type == "text/plain":
-                    plain_text = decoded
-                elif mime_type == "text/html":
-                    html_text = decoded
-            except Exception as e:
-                print(f"⚠️ Failed decoding part: {mime_type} - {e}")
-                continue
-
-    return plain_text, html_text
+# Gmail search query evaluated server-side, e.g. "is:unread newer_than:2d -category:promotions"
+GMAIL_DEFAULT_QUERY = os.getenv("GMAIL_DEFAULT_QUERY", "").strip()
 
 def get_email_body(message: dict) -> str:
-    payload = message.get("payload", {})
-    plain_text = None
-    html_text = None
-
-    if "parts" in payload:
-        plain_text, html_text = extract_parts(payload["parts"])
-    elif "body" in payload and "data" in payload["body"]:
-        try:
-            raw = base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8")
-            html_text = raw  # In fallback, assume HTML
-        except Exception:
-            return "Could not decode email body."
+    body = extract_body(message.get("payload", {}))
+    return body or "No content available"
 
-    # Prefer plain text, fallback to cleaned HTML
-    if plain_text:
-        return plain_text.strip()
-    elif html_text:
-        return BeautifulSoup(html_text, "html.parser").get_text().strip()
 
-    return "No content available"
-
-
-def fetch_recent_emails(max_results: int) -> list:
+def fetch_recent_emails(max_results: int, query: str = None) -> list:
     """
     Retrieves the latest unique emails from the user's Gmail inbox.
 
     Args:
         max_results (int): Number of emails to fetch (default is 3).
+        query (str): Gmail search query (defaults to GMAIL_DEFAULT_QUERY).
 
     Returns:
         list: A list of dictionaries containing email details.
@@ -94,7 +52,13 @@ def fetch_recent_emails(max_results: int) -> list:
 
     try:
         service = build("gmail", "v1", credentials=creds)
-        results = service.users().messages().list(userId="me", labelIds=["INBOX"], maxResults=10).execute()
+        results = service.users().messages().list(
+            userId="me",
+            labelIds=["INBOX"],
+            q=(GMAIL_DEFAULT_QUERY if query is None else query) or None,
+            maxResults=10,
+            fields="messages/id"
+        ).execute()
         messages = results.get("messages", [])
 
         if not messages:
@@ -103,12 +67,14 @@ def fetch_recent_emails(max_results: int) -> list:
         seen_emails = set()
         displayed_emails = []
 
-        for message_info in messages:
+        fetched = batch_get_messages(service, [message_info["id"] for message_info in messages], fields="payload")
+
+        for message in fetched:
             if len(displayed_emails) >= max_results:
                 break
+            if message is None:
+                continue
 
-            message_id = message_info["id"]
-            message = service.users().messages().get(userId="me", id=message_id).execute()
             headers = message["payload"].get("headers", [])
 
             # Extract sender and subject
@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from google.auth.transport.requests import Request
+from src.services.google_exec import run_blocking
+from src.services.google_http import get_session
+from google.oauth2.credentials import Credentials
+from src.api.cred_cryp import encrypt_credentials
+from src.db.db import get_mongo_db
+
+logger = logging.getLogger(__name__)
+
+# Refresh this many seconds before the access token expires
+GOOGLE_TOKEN_REFRESH_MARGIN = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "300"))
+DEFAULT_TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+def to_naive_utc(value) -> Optional[datetime]:
+    """google-auth compares expiry against a naive UTC clock, so store it that way."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class GoogleCredentialManager:
+    """Hands out Google OAuth credentials for Gmail and Calendar.
+
+    Tokens are refreshed ahead of expiry, at most once at a time per user: the first
+    caller refreshes on a worker thread while concurrent callers (from any event loop)
+    wait and then reuse the new token. The refreshed token is requested for every scope
+    the user granted, so one refresh serves all Google services.
+    """
+
+    def __init__(self, refresh_margin: int = GOOGLE_TOKEN_REFRESH_MARGIN):
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._lock = threading.Lock()
+        self._user_locks: Dict[int, threading.Lock] = {}
+        # (user_id, refresh_token) -> (access_token, naive UTC expiry) from the latest refresh
+        self._fresh: Dict[Tuple[int, str], Tuple[str, datetime]] = {}
+        # Bumped by forget() so a refresh already in flight does not store its result afterwards
+        self._generation: Dict[int, int] = {}
+
+    def _user_lock(self, user_id: int) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _needs_refresh(self, token: Optional[str], expiry: Optional[datetime]) -> bool:
+        if not token or expiry is None:
+            return True
+        return datetime.now(timezone.utc).replace(tzinfo=None) >= expiry - self.refresh_margin
+
+    async def get_credentials(self, user_id: int, scopes: Optional[List[str]] = None) -> Optional[Credentials]:
+        """Valid credentials for the user, or None if they are missing or cannot be refreshed."""
+        mongo_db = get_mongo_db()
+        creds_data = await mongo_db.get_user_credentials(user_id)
+        if creds_data is None:
+            logger.error(f"User {user_id} not found")
+            return None
+        if not creds_data:
+            logger.error(f"No API credentials for user {user_id}")
+            return None
+
+        google_creds = creds_data.get("google", {})
+        config = google_creds.get("config", {})
+        token_data = google_creds.get("token", {})
+        if not config or not token_data:
+            logger.error(f"Missing Google config/token for user {user_id}")
+            return None
+
+        creds = Credentials(
+            token=token_data.get("access_token"),
+            refresh_token=token_data.get("refresh_token"),
+            token_uri=token_data.get("token_uri", DEFAULT_TOKEN_URI),
+            client_id=config.get("client_id"),
+            client_secret=config.get("client_secret"),
+            scopes=token_data.get("scopes") or scopes
+        )
+        creds.expiry = to_naive_utc(token_data.get("expiry"))
+
+        if not self._needs_refresh(creds.token, creds.expiry):
+            return creds
+        if not creds.refresh_token:
+            logger.warning(f"Google token for user {user_id} is expiring and has no refresh token")
+            return creds
+
+        try:
+            # On the Google I/O pool like every other user of the shared session
+            refreshed = await run_blocking(self._refresh_sync, user_id, creds, timeout=None)
+        except Exception as e:
+            logger.error(f"Token refresh failed for user {user_id}: {e}")
+            return None
+        if refreshed:
+            await self._persist(user_id, creds)
+        return creds
+
+    def _refresh_sync(self, user_id: int, creds: Credentials) -> bool:
+        """Refresh `creds` in place unless another caller already did. Returns True if this call refreshed."""
+        key = (user_id, creds.refresh_token)
+        with self._user_lock(user_id):
+            generation = self._generation.get(user_id, 0)
+            fresh = self._fresh.get(key)
+            if fresh and not self._needs_refresh(*fresh):
+                creds.token, creds.expiry = fresh
+                return False
+            # Token endpoint calls reuse the pooled connections of the API clients
+            creds.refresh(Request(session=get_session()))
+            with self._lock:
+                if self._generation.get(user_id, 0) == generation:
+                    self._fresh[key] = (creds.token, creds.expiry)
+        logger.info(f"Refreshed Google token for user {user_id}")
+        return True
+
+    async def _persist(self, user_id: int, creds: Credentials) -> None:
+        mongo_db = get_mongo_db()
+        try:
+            creds_data = await mongo_db.get_user_credentials(user_id)
+            token_data = (creds_data or {}).get("google", {}).get("token")
+            if not token_data or token_data.get("refresh_token") != creds.refresh_token:
+                # The user re-authorized while we were refreshing; keep the newer grant
+                return
+            token_data.update({
+                "access_token": creds.token,
+                "expiry": creds.expiry.replace(tzinfo=timezone.utc).isoformat()
+            })
+            await mongo_db.update_user_credentials(
+                user_id, encrypt_credentials(creds_data), decrypted=creds_data
+            )
+        except Exception as e:
+            logger.error(f"Failed to store refreshed Google token for user {user_id}: {e}")
+
+    def forget(self, user_id: int) -> None:
+        """Drop remembered tokens for a user (e.g. after they re-authorize)."""
+        with self._lock:
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+            for key in [k for k in self._fresh if k[0] == user_id]:
+                del self._fresh[key]
+
+google_credentials = GoogleCredentialManager()
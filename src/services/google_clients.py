@@ -0,0 +1,102 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from src.services.google_auth import google_credentials
+from src.services.google_http import get_pooled_http
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CLIENT_CACHE_SIZE = int(os.getenv("GOOGLE_CLIENT_CACHE_SIZE", "256"))
+# Seconds a cached client may sit unused before it is dropped
+GOOGLE_CLIENT_IDLE_TTL = float(os.getenv("GOOGLE_CLIENT_IDLE_TTL", "900"))
+
+@lru_cache(maxsize=None)
+def discovery_document(api: str, version: str) -> Dict[str, Any]:
+    """Discovery document bundled with google-api-python-client, parsed once per process."""
+    doc = discovery_cache.get_static_doc(api, version)
+    if doc is None:
+        raise ValueError(f"No bundled discovery document for {api} {version}")
+    return json.loads(doc)
+
+class SharedAuthorizedHttp:
+    """httplib2-compatible transport that a cached client can share across threads.
+
+    Requests go through the process-wide pooled transport, so TCP/TLS connections are
+    reused across calls, threads and users. The credentials are swapped in place after a
+    token refresh instead of rebuilding the client.
+    """
+
+    def __init__(self, credentials, http=None):
+        self.credentials = credentials
+        self.http = http or get_pooled_http()
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        authed = AuthorizedHttp(self.credentials, http=self.http)
+        return authed.request(uri, method, body=body, headers=headers, **kwargs)
+
+    def close(self):
+        """The pooled transport is shared; nothing to release per client."""
+
+class GoogleServiceCache:
+    """LRU cache of Google API clients keyed by (user, api, version, scopes), with idle eviction."""
+
+    def __init__(self, max_size: int = GOOGLE_CLIENT_CACHE_SIZE, idle_ttl: float = GOOGLE_CLIENT_IDLE_TTL):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        # key -> (last_used, service, transport)
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any, SharedAuthorizedHttp]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict_idle(self, now: float) -> None:
+        while self._entries:
+            key, (last_used, _, _) = next(iter(self._entries.items()))
+            if now - last_used < self.idle_ttl and len(self._entries) <= self.max_size:
+                break
+            del self._entries[key]
+
+    async def get_service(self, user_id: int, api: str, version: str, scopes: Optional[List[str]] = None):
+        """Client for the user with up-to-date credentials, or None if they have no valid credentials."""
+        creds = await google_credentials.get_credentials(user_id, scopes)
+        if not creds:
+            return None
+
+        key = (user_id, api, version, tuple(sorted(scopes or [])))
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                _, service, transport = entry
+                transport.credentials = creds
+                self._entries[key] = (now, service, transport)
+                self._entries.move_to_end(key)
+                return service
+
+        transport = SharedAuthorizedHttp(creds)
+        service = build_from_document(discovery_document(api, version), http=transport)
+        if self.max_size > 0:
+            with self._lock:
+                self._entries[key] = (now, service, transport)
+                self._entries.move_to_end(key)
+                self._evict_idle(now)
+        logger.debug(f"Built {api} {version} client for user {user_id}")
+        return service
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+google_services = GoogleServiceCache()
@@ -0,0 +1,46 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Threads reserved for blocking Google API calls, so they never run on (or starve) the event loop
+GOOGLE_IO_WORKERS = int(os.getenv("GOOGLE_IO_WORKERS", "16"))
+GOOGLE_API_TIMEOUT = float(os.getenv("GOOGLE_API_TIMEOUT", "30"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=GOOGLE_IO_WORKERS, thread_name_prefix="google-io")
+        return _executor
+
+async def run_blocking(func: Callable[..., Any], *args, timeout: Optional[float] = GOOGLE_API_TIMEOUT, **kwargs) -> Any:
+    """Run a blocking Google client call on the Google I/O pool and await it.
+
+    Raises asyncio.TimeoutError after `timeout` seconds. The worker thread itself is not
+    interrupted; the socket timeout of the underlying transport bounds it.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+    if timeout is None:
+        return await future
+    return await asyncio.wait_for(future, timeout)
+
+async def execute_async(request, timeout: Optional[float] = GOOGLE_API_TIMEOUT, **execute_kwargs) -> Any:
+    """Await `request.execute()` for a googleapiclient HttpRequest without blocking the event loop."""
+    return await run_blocking(request.execute, timeout=timeout, **execute_kwargs)
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
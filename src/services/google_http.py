@@ -0,0 +1,110 @@
+import logging
+import os
+import socket
+import threading
+from typing import Optional
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.services.google_exec import GOOGLE_API_TIMEOUT, GOOGLE_IO_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Hosts kept in the pool (googleapis.com endpoints, oauth2, accounts) and keep-alive
+# connections per host. The pool blocks when a host's connections are all in use, and
+# urllib3 gives that wait no timeout. So every caller of the session must run on the
+# google_exec pool (run_blocking / execute_async), and the pool is never smaller than
+# GOOGLE_IO_WORKERS: a free connection then always exists for the thread asking.
+GOOGLE_HTTP_POOL_HOSTS = int(os.getenv("GOOGLE_HTTP_POOL_HOSTS", "10"))
+GOOGLE_HTTP_POOL_MAXSIZE = max(GOOGLE_IO_WORKERS, int(os.getenv("GOOGLE_HTTP_POOL_MAXSIZE", str(GOOGLE_IO_WORKERS))))
+GOOGLE_HTTP_CONNECT_TIMEOUT = float(os.getenv("GOOGLE_HTTP_CONNECT_TIMEOUT", "5"))
+GOOGLE_HTTP_READ_TIMEOUT = float(os.getenv("GOOGLE_HTTP_READ_TIMEOUT", str(GOOGLE_API_TIMEOUT)))
+# Retries for failed connects only; request-level retries stay with the API clients
+GOOGLE_HTTP_CONNECT_RETRIES = int(os.getenv("GOOGLE_HTTP_CONNECT_RETRIES", "2"))
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """Process-wide requests.Session for Google endpoints, with a bounded keep-alive pool.
+
+    Use it only from google_exec worker threads; see GOOGLE_HTTP_POOL_MAXSIZE.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=GOOGLE_HTTP_POOL_HOSTS,
+                pool_maxsize=GOOGLE_HTTP_POOL_MAXSIZE,
+                pool_block=True,  # Wait for a free connection instead of opening unpooled ones
+                max_retries=Retry(total=None, connect=GOOGLE_HTTP_CONNECT_RETRIES, read=0, redirect=5, status=0, backoff_factor=0.2)
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def default_timeout():
+    return (GOOGLE_HTTP_CONNECT_TIMEOUT, GOOGLE_HTTP_READ_TIMEOUT)
+
+class PooledHttp:
+    """httplib2.Http stand-in backed by the shared requests session.
+
+    googleapiclient and google_auth_httplib2 only call request(); unlike httplib2.Http the
+    session's connection pool is thread-safe, so one instance serves every client and thread.
+    """
+
+    def __init__(self, session: Optional[requests.Session] = None, timeout=None):
+        self._session = session
+        self.timeout = timeout or default_timeout()
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session or get_session()
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        try:
+            response = self.session.request(
+                method,
+                uri,
+                data=body,
+                headers=headers,
+                timeout=self.timeout,
+                allow_redirects=redirections > 0
+            )
+        except requests.Timeout as e:
+            # The exception types googleapiclient retries on
+            raise socket.timeout(str(e)) from e
+        except requests.ConnectionError as e:
+            raise ConnectionError(str(e)) from e
+
+        content = response.content
+        info = {key.lower(): value for key, value in response.headers.items()}
+        # requests already decoded the body, as httplib2 would have
+        if info.pop("content-encoding", None):
+            info["content-length"] = str(len(content))
+        info["status"] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, content
+
+    def close(self):
+        """Connections belong to the shared pool; see close_session()."""
+
+_pooled_http: Optional[PooledHttp] = None
+
+def get_pooled_http() -> PooledHttp:
+    global _pooled_http
+    with _session_lock:
+        if _pooled_http is None:
+            _pooled_http = PooledHttp()
+        return _pooled_http
+
+def close_session() -> None:
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
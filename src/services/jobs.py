@@ -1,17 +1,36 @@
 import asyncio
 from datetime import datetime, timedelta
+import hashlib
 import logging
 import json
 import os
+import time
+from typing import Optional
 from src.crews.gmail_crew import CrewContext as EmailCrewContext
 from  src.crews.calendar_crew import CrewContext as CalendarCrewContext
 from  src.crews.linkedin_crew import LinkedInCrewContext
-from src.db.db import get_mongo_db
+from src.db.db import LEGACY_CREW_TYPES, PROCESSED_MESSAGE_MAX_FAILURES, get_mongo_db
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.date import DateTrigger
-from src.services.gmail_d import send_reply
+from src.services.gmail_d import (
+    GMAIL_SYNC_MODE,
+    SCOPES_READ,
+    get_gmail_service,
+    get_reply_context,
+    get_reply_headers,
+    has_new_messages,
+    iter_inbox_chunks,
+    label_messages,
+    thread_for_message,
+)
+from src.services.reply_queue import reply_sender
+from src.tools.g_tools_d import format_emails_for_prompt
 
 logger = logging.getLogger(__name__)
+
+# Full runs score the streamed inbox this many emails per scoring crew run, up to the cap
+GMAIL_SCORING_CHUNK_SIZE = int(os.getenv("GMAIL_SCORING_CHUNK_SIZE", "20"))
+GMAIL_STREAM_MAX_EMAILS = int(os.getenv("GMAIL_STREAM_MAX_EMAILS", "200"))
 mongo_db = get_mongo_db()
 scheduler_manager = AsyncIOScheduler()
 
@@ -26,22 +45,9 @@ async def scheduled_crew_job(user_id: int, crew_id: int):
             logger.error(f"Crew {crew_id} not found for user {user_id}")
             return
         
-        # Handle crew type migration for legacy 'email' type
-        if crew.get('crew_type') == "email":
-            try:
-                update_success = await mongo_db.update_crew(crew_id, {"crew_type": "email_scoring"})
-                if update_success:
-                    logger.info(f"Migrated crew {crew_id} from 'email' to 'email_scoring'")
-                    crew['crew_type'] = "email_scoring"
-                else:
-                    logger.error(f"Failed to migrate crew {crew_id}")
-                    return
-            except Exception as e:
-                logger.error(f"Migration error for crew {crew_id}: {e}")
-                return
-        
-        # Verify we have a valid crew type
-        crew_type = crew.get('crew_type')
+        # Verify we have a valid crew type. Legacy types are migrated in bulk at
+        # startup; any stragglers are mapped here without a write.
+        crew_type = LEGACY_CREW_TYPES.get(crew.get('crew_type'), crew.get('crew_type'))
         if not crew_type:
             logger.error(f"Crew {crew_id} has no type defined")
             return
@@ -99,6 +105,7 @@ async def scheduled_crew_job(user_id: int, crew_id: int):
                 return
         
         # Execute crew
+        started = time.monotonic()
         try:
             if hasattr(crew_instance, 'kickoff_async'):
                 logger.info(f"Executing crew {crew_id} with kickoff_async, inputs={bool(inputs)}")
@@ -117,6 +124,7 @@ async def scheduled_crew_job(user_id: int, crew_id: int):
             "timestamp": datetime.utcnow(),
             "user_id": user_id,
             "crew_id": crew_id,
+            "duration_ms": int((time.monotonic() - started) * 1000),
             "result": json.dumps(result, default=str)
         })
         
@@ -129,8 +137,137 @@ async def scheduled_crew_job(user_id: int, crew_id: int):
             "error": str(e)
         })
 
-async def process_emails_with_scoring_and_reply(user_id: int):
-    """Process emails by scoring urgency and handling replies or scheduling follow-ups."""
+def stable_email_id(email: dict) -> str:
+    """Deterministic fallback ID for a scored email without a Gmail message ID."""
+    digest = hashlib.sha256(email.get('body', '')[:100].encode('utf-8')).hexdigest()
+    return f"body-{digest[:16]}"
+
+async def process_gmail_push(user_id: int):
+    """Run by a debounced Gmail push notification: score and reply only if INBOX gained mail."""
+    try:
+        service = await get_gmail_service(user_id, scopes=SCOPES_READ)
+        if service and await has_new_messages(service, user_id) is False:
+            logger.info(f"Gmail push for user {user_id} brought no new INBOX messages; skipping")
+            return
+    except Exception as e:
+        logger.warning(f"Could not check Gmail history for user {user_id}, processing anyway: {e}")
+    await process_emails_with_scoring_and_reply(user_id, incremental=True)
+
+async def find_or_create_crew(user_id: int, crews: list, crew_type: str) -> int:
+    crew = next((crew for crew in crews if crew.crew_type == crew_type), None)
+    if crew:
+        return crew.crew_id
+    crew_id = await mongo_db.add_crew(user_id, {
+        'crew_type': crew_type,
+        'created_at': datetime.utcnow(),
+        'schedule': {}
+    })
+    logger.info(f"Created new {crew_type} crew with ID {crew_id} for user {user_id}")
+    return crew_id
+
+async def run_scoring_crew(crew_context: EmailCrewContext, scoring_crew_id: int, user_id: int, inputs: dict) -> Optional[list]:
+    """Run the scoring crew once. Returns the scored emails, or None if it failed or scored nothing."""
+    scoring_crew_instance = crew_context.create_scoring_crew()
+    
+    started = time.monotonic()
+    try:
+        logger.debug(f"Executing scoring crew {scoring_crew_id} for user {user_id}")
+        if hasattr(scoring_crew_instance, 'kickoff_async'):
+            scoring_result = await scoring_crew_instance.kickoff_async(inputs=inputs)
+        else:
+            scoring_result = crew_context.create_scoring_crew().kickoff(inputs=inputs)
+        logger.debug(f"Scoring crew result: {scoring_result}")
+    except Exception as e:
+        logger.error(f"Scoring crew {scoring_crew_id} failed for user {user_id}: {str(e)}", exc_info=True)
+        await mongo_db.log_execution({
+            "timestamp": datetime.utcnow(),
+            "user_id": user_id,
+            "crew_id": scoring_crew_id,
+            "duration_ms": int((time.monotonic() - started) * 1000),
+            "error": str(e)
+        })
+        return None
+    
+    logger.info(f"Scoring crew {scoring_crew_id} executed successfully")
+    await mongo_db.log_execution({
+        "timestamp": datetime.utcnow(),
+        "user_id": user_id,
+        "crew_id": scoring_crew_id,
+        "duration_ms": int((time.monotonic() - started) * 1000),
+        "result": json.dumps(scoring_result, default=str)
+    })
+    
+    # Parse scoring result
+    try:
+        result_model = scoring_result.pydantic if hasattr(scoring_result, 'pydantic') else json.loads(scoring_result)
+        if isinstance(result_model, dict):
+            scored_emails = result_model.get('retrieved_emails', [])
+        else:
+            scored_emails = [email_score.dict() for email_score in result_model.scores]
+        if not scored_emails:
+            logger.warning(f"No emails scored by crew {scoring_crew_id} for user {user_id}")
+            return None
+        logger.debug(f"Scored emails: {json.dumps(scored_emails, default=str)}")
+        return scored_emails
+    except (json.JSONDecodeError, AttributeError) as e:
+        logger.error(f"Failed to parse scoring result for crew {scoring_crew_id}: {str(e)}", exc_info=True)
+        await mongo_db.log_execution({
+            "timestamp": datetime.utcnow(),
+            "user_id": user_id,
+            "crew_id": scoring_crew_id,
+            "error": f"Invalid scoring result format: {str(e)}"
+        })
+        return None
+
+async def handle_scored_emails(scored_emails: list, crew_context: EmailCrewContext, reply_crew_id: int, user_id: int) -> bool:
+    """Reply to or schedule a follow-up for each scored email, record and label them. Returns True if all were handled."""
+    processed_ids, urgent_ids = [], []
+    all_handled = True
+    for email in scored_emails:
+        email_score = email.get('urgency_score', 0)
+        email_id = email.get('id') or stable_email_id(email)
+        logger.info(f"Processing email ID {email_id} with score {email_score}")
+        
+        if email_score < 5:
+            handled = await handle_urgent_email(email, crew_context, reply_crew_id, user_id)
+            action = "reply_queued" if handled else "reply_failed"
+        else:
+            handled = await schedule_followup(email, crew_context, reply_crew_id, user_id)
+            action = "followup_scheduled" if handled else "followup_failed"
+        all_handled = all_handled and handled
+        
+        # Ledger entries keep the fetch stage from handing these messages to the scoring crew
+        # again; failed ones are handed out again up to PROCESSED_MESSAGE_MAX_FAILURES times.
+        # In thread mode the whole thread was handled at once
+        thread = thread_for_message(user_id, email.get('id'))
+        message_ids = thread['message_ids'] if thread else [email_id]
+        for message_id in message_ids:
+            failures = await mongo_db.record_processed_message(
+                user_id,
+                message_id,
+                score=email.get('urgency_score', email.get('score')),
+                action=action,
+                failed=not handled
+            )
+            if failures and failures >= PROCESSED_MESSAGE_MAX_FAILURES:
+                logger.warning(f"Giving up on message {message_id} for user {user_id} after {failures} failures")
+        if email.get('id') and handled:
+            # Failed ones stay unlabelled so full fetches still return them
+            processed_ids.extend(message_ids)
+            if email_score < 5:
+                urgent_ids.extend(message_ids)
+    
+    # Label handled messages in the mailbox too; the fetch query excludes the processed label
+    await label_messages(user_id, processed_ids, urgent_ids)
+    return all_handled
+
+async def process_emails_with_scoring_and_reply(user_id: int, incremental: Optional[bool] = None):
+    """Process emails by scoring urgency and handling replies or scheduling follow-ups.
+    
+    Incremental runs let the scoring crew fetch the new mail through its tool. Full runs
+    stream the inbox through iter_inbox_chunks and score each chunk as it arrives, up to
+    GMAIL_STREAM_MAX_EMAILS emails, so large mailboxes are never loaded in one list.
+    """
     try:
         logger.info(f"Starting email processing for user {user_id}")
         
@@ -139,110 +276,57 @@ async def process_emails_with_scoring_and_reply(user_id: int):
             scheduler_manager.start()
             logger.info("Started AsyncIOScheduler for email follow-ups")
         
-        # Find or create scoring crew
         crews = await mongo_db.get_user_crews(user_id)
-        scoring_crew = next((crew for crew in crews if crew.crew_type == 'email_scoring'), None)
-        if not scoring_crew:
-            scoring_crew_id = await mongo_db.add_crew(user_id, {
-                'crew_type': 'email_scoring',
-                'created_at': datetime.utcnow(),
-                'schedule': {}
-            })
-            logger.info(f"Created new email_scoring crew with ID {scoring_crew_id} for user {user_id}")
-        else:
-            scoring_crew_id = scoring_crew.crew_id
+        scoring_crew_id = await find_or_create_crew(user_id, crews, 'email_scoring')
+        reply_crew_id = await find_or_create_crew(user_id, crews, 'email_reply')
+        if incremental is None:
+            incremental = GMAIL_SYNC_MODE == "incremental"
         
-        # Execute scoring crew
-        crew_context = EmailCrewContext(user_id)
-        scoring_crew_instance = crew_context.create_scoring_crew()
-        
-        try:
-            logger.debug(f"Executing scoring crew {scoring_crew_id} for user {user_id}")
-            if hasattr(scoring_crew_instance, 'kickoff_async'):
-                scoring_result = await scoring_crew_instance.kickoff_async(inputs={})
-            else:
-                scoring_result = crew_context.create_scoring_crew().kickoff(inputs={})
-            logger.debug(f"Scoring crew result: {scoring_result}")
-        except Exception as e:
-            logger.error(f"Scoring crew {scoring_crew_id} failed for user {user_id}: {str(e)}", exc_info=True)
-            await mongo_db.log_execution({
-                "timestamp": datetime.utcnow().isoformat(),
-                "user_id": user_id,
-                "crew_id": scoring_crew_id,
-                "error": str(e)
-            })
+        if not incremental:
+            crew_context = EmailCrewContext(user_id, incremental=False, with_fetch_tool=False)
+            chunks = 0
+            async for chunk in iter_inbox_chunks(user_id, GMAIL_SCORING_CHUNK_SIZE, limit=GMAIL_STREAM_MAX_EMAILS):
+                chunks += 1
+                scored_emails = await run_scoring_crew(
+                    crew_context, scoring_crew_id, user_id, {"context": format_emails_for_prompt(chunk)}
+                )
+                if scored_emails:
+                    await handle_scored_emails(scored_emails, crew_context, reply_crew_id, user_id)
+            logger.info(f"Scored {chunks} inbox chunks for user {user_id}")
             return
         
-        logger.info(f"Scoring crew {scoring_crew_id} executed successfully")
-        await mongo_db.log_execution({
-            "timestamp": datetime.utcnow().isoformat(),
-            "user_id": user_id,
-            "crew_id": scoring_crew_id,
-            "result": json.dumps(scoring_result, default=str)
-        })
-        
-        # Parse scoring result
-        try:
-            result_model = scoring_result.pydantic if hasattr(scoring_result, 'pydantic') else json.loads(scoring_result)
-            if isinstance(result_model, dict):
-                scored_emails = result_model.get('retrieved_emails', [])
-            else:
-                scored_emails = [email_score.dict() for email_score in result_model.scores]
-            if not scored_emails:
-                logger.warning(f"No emails scored by crew {scoring_crew_id} for user {user_id}")
-                return
-            logger.debug(f"Scored emails: {json.dumps(scored_emails, default=str)}")
-        except (json.JSONDecodeError, AttributeError) as e:
-            logger.error(f"Failed to parse scoring result for crew {scoring_crew_id}: {str(e)}", exc_info=True)
-            await mongo_db.log_execution({
-                "timestamp": datetime.utcnow().isoformat(),
-                "user_id": user_id,
-                "crew_id": scoring_crew_id,
-                "error": f"Invalid scoring result format: {str(e)}"
-            })
+        crew_context = EmailCrewContext(user_id, incremental=True)
+        scored_emails = await run_scoring_crew(crew_context, scoring_crew_id, user_id, {})
+        if not scored_emails:
             return
+        all_handled = await handle_scored_emails(scored_emails, crew_context, reply_crew_id, user_id)
         
-        # Find or create reply crew
-        reply_crew = next((crew for crew in crews if crew.crew_type == 'email_reply'), None)
-        if not reply_crew:
-            reply_crew_id = await mongo_db.add_crew(user_id, {
-                'crew_type': 'email_reply',
-                'created_at': datetime.utcnow(),
-                'schedule': {}
-            })
-            logger.info(f"Created new email_reply crew with ID {reply_crew_id} for user {user_id}")
-        else:
-            reply_crew_id = reply_crew.crew_id
-        
-        # Process each scored email
-        for email in scored_emails:
-            email_score = email.get('urgency_score', 0)
-            email_id = email.get('id', str(hash(email.get('body', '')[:100])))
-            logger.info(f"Processing email ID {email_id} with score {email_score}")
-            
-            if email_score < 5:
-                await handle_urgent_email(email, crew_context, reply_crew_id, user_id)
-            else:
-                await schedule_followup(email, crew_context, reply_crew_id, user_id)
+        # Only now move the incremental sync checkpoint past this batch; after a failure the
+        # next run reads the same history again and the ledger drops what was handled
+        if all_handled:
+            await mongo_db.commit_gmail_history_id(user_id)
         
     except Exception as e:
         logger.error(f"Email processing failed for user {user_id}: {str(e)}", exc_info=True)
         await mongo_db.log_execution({
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow(),
             "user_id": user_id,
             "crew_id": None,
             "error": str(e)
         })
 
-async def handle_urgent_email(email: dict, crew_context: EmailCrewContext, reply_crew_id: int, user_id: int):
-    """Handle immediate reply for emails with urgency score < 5."""
+async def handle_urgent_email(email: dict, crew_context: EmailCrewContext, reply_crew_id: int, user_id: int) -> bool:
+    """Handle immediate reply for emails with urgency score < 5. Returns True if a reply was queued for sending."""
     try:
         email_id = email.get('id', 'unknown')
         email_score = email.get('urgency_score', 0)
         logger.debug(f"Handling urgent email {email_id} with score {email_score} for user {user_id}")
         
         reply_crew_instance = crew_context.create_reply_crew()
-        reply_inputs = {"context": email.get('body', '')}
+        # Scoring only saw the snippet (or the newest message of a thread); load the full context for the reply
+        body = await get_reply_context(user_id, email_id) if email.get('id') else ""
+        reply_headers = await get_reply_headers(user_id, email_id) if email.get('id') else {}
+        reply_inputs = {"context": body or email.get('body', '')}
         
         try:
             logger.debug(f"Executing reply crew {reply_crew_id} for email {email_id} with inputs: {reply_inputs}")
@@ -254,12 +338,12 @@ async def handle_urgent_email(email: dict, crew_context: EmailCrewContext, reply
         except Exception as e:
             logger.error(f"Reply crew {reply_crew_id} failed for email {email_id}: {str(e)}", exc_info=True)
             await mongo_db.log_execution({
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": datetime.utcnow(),
                 "user_id": user_id,
                 "crew_id": reply_crew_id,
                 "error": f"Failed to generate reply for email {email_id}: {str(e)}"
             })
-            return
+            return False
         
         # Parse reply
         try:
@@ -271,12 +355,12 @@ async def handle_urgent_email(email: dict, crew_context: EmailCrewContext, reply
             if not replies:
                 logger.warning(f"No reply generated for email {email_id}")
                 await mongo_db.log_execution({
-                    "timestamp": datetime.utcnow().isoformat(),
+                    "timestamp": datetime.utcnow(),
                     "user_id": user_id,
                     "crew_id": reply_crew_id,
                     "result": f"No reply generated for email {email_id}"
                 })
-                return
+                return False
             
             # Assume first reply
             reply = replies[0].model_dump() if isinstance(replies, list) else replies.model_dump()
@@ -284,47 +368,53 @@ async def handle_urgent_email(email: dict, crew_context: EmailCrewContext, reply
             reply_body = reply.get('body', '')
             reply_to = email.get('from', '')
             
-            logger.debug(f"Sending reply for email {email_id}: to={reply_to}, subject={reply_subject}, body={reply_body[:50]}...")
-            # Send reply
-            success = await send_reply(user_id, reply_to, reply_subject, reply_body)
-            if success:
-                logger.info(f"Sent reply for email ID {email_id}")
+            logger.debug(f"Queueing reply for email {email_id}: to={reply_to}, subject={reply_subject}, body={reply_body[:50]}...")
+            # The outbound queue sends it; a retried job finds the same key and does not send twice
+            queued = await reply_sender.enqueue(
+                user_id, email.get('id') or stable_email_id(email), reply_to, reply_subject, reply_body, **reply_headers
+            )
+            if queued:
+                logger.info(f"Queued reply for email ID {email_id}")
                 await mongo_db.log_execution({
-                    "timestamp": datetime.utcnow().isoformat(),
+                    "timestamp": datetime.utcnow(),
                     "user_id": user_id,
                     "crew_id": reply_crew_id,
-                    "result": f"Sent reply for email {email_id}"
+                    "result": f"Queued reply for email {email_id}"
                 })
+                return True
             else:
-                logger.error(f"Failed to send reply for email {email_id}: send_reply returned False")
+                logger.error(f"Failed to queue reply for email {email_id}")
                 await mongo_db.log_execution({
-                    "timestamp": datetime.utcnow().isoformat(),
+                    "timestamp": datetime.utcnow(),
                     "user_id": user_id,
                     "crew_id": reply_crew_id,
-                    "error": f"Failed to send reply for email {email_id}: send_reply returned False"
+                    "error": f"Failed to queue reply for email {email_id}"
                 })
+                return False
         except Exception as e:
             logger.error(f"Failed to process reply for email {email_id}: {str(e)}", exc_info=True)
             await mongo_db.log_execution({
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": datetime.utcnow(),
                 "user_id": user_id,
                 "crew_id": reply_crew_id,
                 "error": f"Failed to process reply for email {email_id}: {str(e)}"
             })
+            return False
             
     except Exception as e:
         logger.error(f"Failed to handle urgent email {email_id}: {str(e)}", exc_info=True)
         await mongo_db.log_execution({
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow(),
             "user_id": user_id,
             "crew_id": reply_crew_id,
             "error": f"Failed to handle urgent email {email_id}: {str(e)}"
         })
+        return False
 
-async def schedule_followup(email: dict, crew_context: EmailCrewContext, reply_crew_id: int, user_id: int):
-    """Schedule follow-up for emails with urgency score >= 5."""
+async def schedule_followup(email: dict, crew_context: EmailCrewContext, reply_crew_id: int, user_id: int) -> bool:
+    """Schedule follow-up for emails with urgency score >= 5. Returns True if the follow-up was scheduled."""
     try:
-        email_id = email.get('id', str(hash(email.get('body', '')[:100])))
+        email_id = email.get('id') or stable_email_id(email)
         email_score = email.get('urgency_score', 0)
         logger.debug(f"Scheduling follow-up for email {email_id} with score {email_score} for user {user_id}")
         
@@ -339,12 +429,20 @@ async def schedule_followup(email: dict, crew_context: EmailCrewContext, reply_c
         else:
             followup_time = datetime.now().astimezone() + timedelta(hours=2)
         
-        def job_func():
+        # Resolve the thread now: the in-process thread cache may not hold it two hours from now
+        thread = thread_for_message(user_id, email.get('id'))
+        context = thread['transcript'] if thread else None
+        reply_headers = await get_reply_headers(user_id, email['id']) if email.get('id') else {}
+        
+        def job_func(context, reply_headers):
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             reply_crew_instance = crew_context.create_reply_crew()
-            reply_inputs = {"context": email.get('body', '')}
             try:
+                if not context and email.get('id'):
+                    context = loop.run_until_complete(get_reply_context(user_id, email['id']))
+                body = context or ""
+                reply_inputs = {"context": body or email.get('body', '')}
                 logger.debug(f"Executing scheduled reply crew {reply_crew_id} for email {email_id}")
                 if hasattr(reply_crew_instance, 'kickoff_async'):
                     reply_result = loop.run_until_complete(reply_crew_instance.kickoff_async(inputs=reply_inputs))
@@ -359,7 +457,7 @@ async def schedule_followup(email: dict, crew_context: EmailCrewContext, reply_c
                 if not replies:
                     logger.warning(f"No reply generated for scheduled email {email_id}")
                     loop.run_until_complete(mongo_db.log_execution({
-                        "timestamp": datetime.utcnow().isoformat(),
+                        "timestamp": datetime.utcnow(),
                         "user_id": user_id,
                         "crew_id": reply_crew_id,
                         "result": f"No reply generated for scheduled email {email_id}"
@@ -371,29 +469,29 @@ async def schedule_followup(email: dict, crew_context: EmailCrewContext, reply_c
                 reply_body = reply.get('body', '')
                 reply_to = email.get('from', '')
                 
-                success = loop.run_until_complete(
-                    send_reply(user_id, reply_to, reply_subject, reply_body)
+                queued = loop.run_until_complete(
+                    reply_sender.enqueue(user_id, email_id, reply_to, reply_subject, reply_body, **reply_headers)
                 )
-                if success:
-                    logger.info(f"Sent scheduled reply for email ID {email_id}")
+                if queued:
+                    logger.info(f"Queued scheduled reply for email ID {email_id}")
                     loop.run_until_complete(mongo_db.log_execution({
-                        "timestamp": datetime.utcnow().isoformat(),
+                        "timestamp": datetime.utcnow(),
                         "user_id": user_id,
                         "crew_id": reply_crew_id,
-                        "result": f"Sent scheduled reply for email {email_id}"
+                        "result": f"Queued scheduled reply for email {email_id}"
                     }))
                 else:
-                    logger.error(f"Failed to send scheduled reply for email {email_id}: send_reply returned False")
+                    logger.error(f"Failed to queue scheduled reply for email {email_id}")
                     loop.run_until_complete(mongo_db.log_execution({
-                        "timestamp": datetime.utcnow().isoformat(),
+                        "timestamp": datetime.utcnow(),
                         "user_id": user_id,
                         "crew_id": reply_crew_id,
-                        "error": f"Failed to send scheduled reply for email {email_id}: send_reply returned False"
+                        "error": f"Failed to queue scheduled reply for email {email_id}"
                     }))
             except Exception as e:
                 logger.error(f"Scheduled reply failed for email {email_id}: {str(e)}", exc_info=True)
                 loop.run_until_complete(mongo_db.log_execution({
-                    "timestamp": datetime.utcnow().isoformat(),
+                    "timestamp": datetime.utcnow(),
                     "user_id": user_id,
                     "crew_id": reply_crew_id,
                     "error": f"Scheduled reply failed for email {email_id}: {str(e)}"
@@ -404,23 +502,26 @@ async def schedule_followup(email: dict, crew_context: EmailCrewContext, reply_c
         scheduler_manager.add_job(
             job_func,
             trigger=DateTrigger(run_date=followup_time),
+            args=(context, reply_headers),
             id=f"email_followup_{email_id}",
             replace_existing=True
         )
         logger.info(f"Scheduled follow-up for email ID {email_id} at {followup_time}")
         
         await mongo_db.log_execution({
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow(),
             "user_id": user_id,
             "crew_id": reply_crew_id,
             "result": f"Scheduled follow-up for email {email_id} at {followup_time}"
         })
+        return True
         
     except Exception as e:
         logger.error(f"Failed to schedule follow-up for email {email_id}: {str(e)}", exc_info=True)
         await mongo_db.log_execution({
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": datetime.utcnow(),
             "user_id": user_id,
             "crew_id": reply_crew_id,
             "error": f"Failed to schedule follow-up for email {email_id}: {str(e)}"
-        })
\ No newline at end of file
+        })
+        return False
\ No newline at end of file
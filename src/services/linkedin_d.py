@@ -1,7 +1,6 @@
 import requests
 from datetime import datetime, timezone ,timedelta
 from src.db.db import get_mongo_db
-from src.api.cred_cryp import decrypt_credentials
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,13 +16,12 @@ class LinkedInService:
         try:
             logger.info(f"Initializing LinkedInService for user_id={self.user_id}")
             mongo_db = get_mongo_db()
-            user = await mongo_db.get_user(self.user_id)
+            creds_data = await mongo_db.get_user_credentials(self.user_id)
             
-            if not user or not user.api_credentials:
+            if not creds_data:
                 logger.error(f"User credentials not found for user_id={self.user_id}")
                 raise ValueError("User credentials not found")
                 
-            creds_data = decrypt_credentials(user.api_credentials)
             linkedin_creds = creds_data.get("linkedin", {})
             
             if not linkedin_creds:
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from src.db.db import get_mongo_db
+from src.services.gmail_batch import batch_execute, is_retryable
+from src.services.gmail_d import SCOPES_SEND, build_reply_message, get_gmail_service
+from src.services.google_exec import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Replies leased per dispatch round
+REPLY_QUEUE_BATCH_SIZE = int(os.getenv("REPLY_QUEUE_BATCH_SIZE", "25"))
+REPLY_QUEUE_POLL_INTERVAL = float(os.getenv("REPLY_QUEUE_POLL_INTERVAL", "5"))
+# A reply left in "sending" longer than this (sender crashed) is picked up again
+REPLY_QUEUE_LEASE_SECONDS = float(os.getenv("REPLY_QUEUE_LEASE_SECONDS", "120"))
+# Per-user token bucket: sustained sends per second and burst size. Gmail's send quota
+# is per user, so one busy mailbox never delays another.
+REPLY_SEND_RATE = float(os.getenv("REPLY_SEND_RATE", "0.5"))
+REPLY_SEND_BURST = int(os.getenv("REPLY_SEND_BURST", "5"))
+REPLY_MAX_ATTEMPTS = int(os.getenv("REPLY_MAX_ATTEMPTS", "6"))
+REPLY_BACKOFF_BASE = float(os.getenv("REPLY_BACKOFF_BASE", "30"))
+REPLY_BACKOFF_MAX = float(os.getenv("REPLY_BACKOFF_MAX", "3600"))
+
+def idempotency_key(user_id: int, source_message_id: str) -> str:
+    return f"{user_id}:{source_message_id}"
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of failed attempts."""
+    delay = min(REPLY_BACKOFF_MAX, REPLY_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay + random.uniform(0, delay / 4)
+
+class TokenBucket:
+    """Per-key token buckets refilled at `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate: float = REPLY_SEND_RATE, burst: int = REPLY_SEND_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets: Dict[Any, List[float]] = {}  # key -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def take(self, key: Any, wanted: int) -> int:
+        """Take up to `wanted` whole tokens; returns how many were granted."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            granted = min(wanted, int(tokens))
+            self._buckets[key] = [tokens - granted, now]
+            return granted
+
+    def wait_time(self, key: Any) -> float:
+        """Seconds until `key` has a whole token again."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+            if tokens >= 1 or self.rate <= 0:
+                return 0.0
+            return (1 - tokens) / self.rate
+
+class ReplySender:
+    """Background sender for the persistent outbound reply queue.
+
+    enqueue() stores a reply in `outbound_replies` keyed by user and source message, so
+    retried jobs never send twice, and returns without waiting for Gmail. The sender
+    leases due replies, sends each user's share in one batch HTTP call within the user's
+    token bucket, and reschedules 429/5xx failures with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = REPLY_QUEUE_BATCH_SIZE,
+        poll_interval: float = REPLY_QUEUE_POLL_INTERVAL,
+        lease_seconds: float = REPLY_QUEUE_LEASE_SECONDS,
+        max_attempts: int = REPLY_MAX_ATTEMPTS,
+        limiter: Optional[TokenBucket] = None
+    ):
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.limiter = limiter or TokenBucket()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def enqueue(
+        self,
+        user_id: int,
+        source_message_id: str,
+        recipient_email: str,
+        subject: str,
+        reply_body: str,
+        thread_id: Optional[str] = None,
+        in_reply_to: Optional[str] = None
+    ) -> bool:
+        """Queue a reply to `source_message_id`. Returns True if it is (or already was) queued."""
+        key = idempotency_key(user_id, source_message_id)
+        try:
+            created = await get_mongo_db().enqueue_outbound_reply({
+                "idempotency_key": key,
+                "user_id": user_id,
+                "source_message_id": source_message_id,
+                "to": recipient_email,
+                "subject": subject,
+                "body": reply_body,
+                "thread_id": thread_id,
+                "in_reply_to": in_reply_to
+            })
+        except Exception as e:
+            logger.error(f"Failed to queue reply {key}: {e}", exc_info=True)
+            return False
+        if created:
+            logger.info(f"Queued reply {key}")
+            self.notify()
+        else:
+            logger.info(f"Reply {key} already queued; skipping duplicate")
+        return True
+
+    def notify(self) -> None:
+        """Wake the sender early. Safe to call from jobs running on other threads and loops."""
+        if self.running:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self) -> None:
+        """Start the sender on the running event loop."""
+        if self.running:
+            return
+        self._stopping = False
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+        logger.info("Started outbound reply sender")
+
+    async def stop(self) -> None:
+        """Stop the sender after its current round; queued replies stay in the collection."""
+        if self.running:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            logger.info("Stopped outbound reply sender")
+        self._task = None
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                leased = await self.dispatch()
+            except Exception as e:
+                logger.error(f"Outbound reply dispatch failed: {e}", exc_info=True)
+                leased = 0
+            if leased >= self.batch_size:
+                continue  # More may be due; go again without waiting
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def dispatch(self) -> int:
+        """Run one send round. Returns the number of replies leased."""
+        mongo_db = get_mongo_db()
+        replies = await mongo_db.claim_outbound_replies(self.batch_size, self.lease_seconds)
+        if not replies:
+            return 0
+
+        by_user: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for reply in replies:
+            by_user[reply["user_id"]].append(reply)
+
+        await asyncio.gather(*(self._send_user_batch(user_id, batch) for user_id, batch in by_user.items()))
+        return len(replies)
+
+    async def _send_user_batch(self, user_id: int, replies: List[Dict[str, Any]]) -> None:
+        mongo_db = get_mongo_db()
+        sendable, bodies = [], []
+        for reply in replies:
+            try:
+                bodies.append(build_reply_message(
+                    reply["to"], reply["subject"], reply["body"], reply.get("thread_id"), reply.get("in_reply_to")
+                ))
+                sendable.append(reply)
+            except ValueError as e:
+                await self._fail(reply, e, retryable=False)
+
+        granted = self.limiter.take(user_id, len(sendable))
+        if granted < len(sendable):
+            # Over the user's send rate: hand the rest back without counting an attempt
+            wait = max(self.limiter.wait_time(user_id), 1.0)
+            next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=wait)
+            for reply in sendable[granted:]:
+                await mongo_db.update_outbound_reply(
+                    reply["idempotency_key"], {"status": "pending", "next_attempt_at": next_attempt_at}
+                )
+            logger.debug(f"Rate limited {len(sendable) - granted} replies for user {user_id} for {wait:.1f}s")
+            sendable, bodies = sendable[:granted], bodies[:granted]
+
+        if not sendable:
+            return
+        service = await get_gmail_service(user_id, scopes=SCOPES_SEND)
+        if not service:
+            error = RuntimeError(f"Failed to create Gmail service for user {user_id}")
+            for reply in sendable:
+                await self._fail(reply, error, retryable=True)
+            return
+
+        messages = service.users().messages()
+        requests = [messages.send(userId="me", body=body) for body in bodies]
+        failures: Dict[int, Exception] = {}
+        try:
+            # Retries are scheduled through the queue, not slept on inside the batch call
+            results = await run_blocking(batch_execute, service, requests, timeout=None, max_retries=0, failures=failures)
+        except Exception as e:
+            results = [None] * len(requests)
+            failures = {index: e for index in range(len(requests))}
+
+        for index, reply in enumerate(sendable):
+            if results[index] is not None:
+                await mongo_db.update_outbound_reply(reply["idempotency_key"], {
+                    "status": "sent",
+                    "sent_at": datetime.now(timezone.utc),
+                    "gmail_message_id": results[index].get("id")
+                }, inc_attempts=True)
+                logger.info(f"Sent queued reply {reply['idempotency_key']}")
+            else:
+                error = failures.get(index) or RuntimeError("Gmail returned no response")
+                await self._fail(reply, error, retryable=is_retryable(error))
+
+    async def _fail(self, reply: Dict[str, Any], error: Exception, retryable: bool) -> None:
+        attempts = reply.get("attempts", 0) + 1
+        key = reply["idempotency_key"]
+        if retryable and attempts < self.max_attempts:
+            delay = retry_delay(attempts)
+            logger.warning(f"Reply {key} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+            await get_mongo_db().update_outbound_reply(key, {
+                "status": "pending",
+                "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                "last_error": str(error)
+            }, inc_attempts=True)
+        else:
+            logger.error(f"Reply {key} failed permanently after {attempts} attempts: {error}")
+            await get_mongo_db().update_outbound_reply(key, {
+                "status": "failed",
+                "last_error": str(error)
+            }, inc_attempts=True)
+
+reply_sender = ReplySender()
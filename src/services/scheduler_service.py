@@ -1,38 +1,39 @@
 import os
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.mongodb import MongoDBJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.base import JobLookupError
 from apscheduler.executors.asyncio import AsyncIOExecutor
 from apscheduler.triggers.cron import CronTrigger
-from motor.motor_asyncio import AsyncIOMotorClient
 from src.db.db import get_mongo_db
+from src.db.indexes import IndexManager
 from typing import Callable, Dict, Any
 import uuid
 import logging
-from motor.motor_asyncio import AsyncIOMotorClient
 from apscheduler.schedulers.asyncio import AsyncIOScheduler 
-from pymongo import MongoClient
 import asyncio
 
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(MONGO_URI)
-db = client.crewai_scheduler
-
 mongo_db = get_mongo_db()
 
 logger = logging.getLogger(__name__)
 
 class SchedulerManager:
     def __init__(self):
-        self.sync_client = MongoClient(MONGO_URI)
-        self.async_client = AsyncIOMotorClient(MONGO_URI)
-        self.async_db = self.async_client.crewai_scheduler
+        if mongo_db.registry.in_memory:
+            # APScheduler's MongoDB store needs a real pymongo client
+            self.sync_client = None
+            jobstore = MemoryJobStore()
+        else:
+            # Share the process-wide MongoDB pool instead of opening dedicated clients
+            self.sync_client = mongo_db.registry.get_sync_client()
+            jobstore = MongoDBJobStore(
+                database='crewai_scheduler',
+                collection='apscheduler_jobs',
+                client=self.sync_client
+            )
         self.scheduler = AsyncIOScheduler(
             jobstores={
-                'default': MongoDBJobStore(
-                    database='crewai_scheduler',
-                    collection='apscheduler_jobs',
-                    client=self.sync_client
-                ),
+                'default': jobstore,
             },
             executors={
                 'default': AsyncIOExecutor()
@@ -40,6 +41,10 @@ class SchedulerManager:
             timezone="UTC"
         )
 
+    @property
+    def async_db(self):
+        return mongo_db.db
+
     async def init_scheduler(self):
         try:
             await self._create_indexes()
@@ -51,9 +56,7 @@ class SchedulerManager:
 
     async def _create_indexes(self):
         try:
-            await self.async_db.jobs.create_index("job_id", unique=True)
-            await self.async_db.jobs.create_index("status")
-            await self.async_db.jobs.create_index("next_run")
+            await IndexManager(self.async_db).ensure_indexes(["jobs"])
             logger.info("Created MongoDB indexes")
         except Exception as e:
             logger.error(f"Failed to create indexes: {e}")
@@ -120,6 +123,22 @@ class SchedulerManager:
             logger.error(f"Failed to schedule job {job_id}: {e}")
             raise
 
+    async def remove_jobs(self, metadata: Dict[str, Any]) -> list:
+        """Remove the active jobs whose metadata matches every given field. Returns their IDs."""
+        query = {"status": "active", **{f"metadata.{key}": value for key, value in metadata.items()}}
+        jobs = [job async for job in self.async_db.jobs.find(query, {"_id": 0, "job_id": 1})]
+        removed = []
+        for job in jobs:
+            try:
+                self.scheduler.remove_job(job["job_id"])
+            except JobLookupError:
+                pass  # Already gone from the job store
+            await self.async_db.jobs.update_one({"job_id": job["job_id"]}, {"$set": {"status": "removed"}})
+            removed.append(job["job_id"])
+        if removed:
+            logger.info(f"Removed jobs {removed}")
+        return removed
+
     def get_scheduler(self):
         return self.scheduler
 
@@ -5,11 +5,37 @@ import re
 import logging
 import asyncio
 import nest_asyncio
+from typing import Optional
 from src.services.gmail_d import fetch_recent_emails
+from src.services.email_body import summarize_for_prompt
 from src.db.db import get_mongo_db
 
 logger = logging.getLogger(__name__)
 
+def format_emails_for_prompt(emails: list) -> str:
+    """JSON the scoring crew reads: one entry per email (or thread) with a trimmed body."""
+    formatted_emails = []
+    for email in emails:
+        subject = email.get("subject", "No Subject")
+        body = email.get("body", email.get("snippet", "No Summary"))
+        email_id = email.get("id", "unknown")
+        from_address = email.get("from", "Unknown Sender")
+        
+        subject = re.sub(r"^(Re:\s*)+", "Re: ", subject).strip()
+        body = summarize_for_prompt(body)
+        
+        formatted_email = {
+            "📩 ID": email_id,
+            "📧 From": from_address,
+            "📝 Subject": subject,
+            "📄 Body": body
+        }
+        if email.get("message_count", 1) > 1:
+            # Thread mode: one entry stands for the whole conversation
+            formatted_email["🧵 Thread"] = f"{email['message_count']} messages, latest shown"
+        formatted_emails.append(formatted_email)
+    return json.dumps({"📬 Retrieved Emails": formatted_emails}, indent=2)
+
 class FetchEmailsInput(BaseModel):
     """Input schema for the Fetch Recent Emails Tool"""
     max_results: int = Field(
@@ -23,10 +49,12 @@ class FetchRecentEmailsTool(BaseTool):
     args_schema: type[BaseModel] = FetchEmailsInput
     
     _user_id: int = PrivateAttr()
+    _incremental: Optional[bool] = PrivateAttr(default=None)
 
-    def __init__(self, user_id: int):
+    def __init__(self, user_id: int, incremental: Optional[bool] = None):
         super().__init__()
         self._user_id = user_id
+        self._incremental = incremental  # None follows GMAIL_SYNC_MODE
         nest_asyncio.apply()  # Apply nest_asyncio globally
 
     async def _arun(self, max_results: int) -> str:
@@ -50,30 +78,11 @@ class FetchRecentEmailsTool(BaseTool):
             except RuntimeError:
                 pass  # No running loop
 
-            emails = await fetch_recent_emails(self._user_id, max_results)
+            emails = await fetch_recent_emails(self._user_id, max_results, incremental=self._incremental)
             logger.debug(f"Fetched {len(emails)} raw emails for user {self._user_id}")
             
-            formatted_emails = []
-            for email in emails:
-                subject = email.get("subject", "No Subject")
-                body = email.get("body", email.get("snippet", "No Summary"))
-                email_id = email.get("id", "unknown")
-                from_address = email.get("from", "Unknown Sender")
-                
-                subject = re.sub(r"^(Re:\s*)+", "Re: ", subject).strip()
-                body = re.sub(r"[\r\n]+", "\n", body).strip()
-                body = re.sub(r"\.{5,}", "...", body)
-                body = (body[:500] + "...") if len(body) > 500 else body
-                
-                formatted_emails.append({
-                    "📩 ID": email_id,
-                    "📧 From": from_address,
-                    "📝 Subject": subject,
-                    "📄 Body": body
-                })
-            
-            logger.info(f"Formatted {len(formatted_emails)} emails for user {self._user_id}")
-            return json.dumps({"📬 Retrieved Emails": formatted_emails}, indent=2)
+            logger.info(f"Formatted {len(emails)} emails for user {self._user_id}")
+            return format_emails_for_prompt(emails)
             
         except Exception as e:
             logger.error(f"Email fetch error for user {self._user_id}: {e}", exc_info=True)
@@ -97,8 +106,11 @@ class FetchRecentEmailsTool(BaseTool):
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             nest_asyncio.apply(loop)
-            
-            return loop.run_until_complete(self._arun(max_results))
+            try:
+                return loop.run_until_complete(self._arun(max_results))
+            finally:
+                # A closed loop lets the client registry release the MongoDB client bound to it
+                loop.close()
         except Exception as e:
             logger.error(f"Error in _run: {e}", exc_info=True)
             return json.dumps({"📬 Retrieved Emails": [], "error": str(e)})
\ No newline at end of file